@@ -2,10 +2,14 @@ from django.contrib import admin
 from django.db import transaction
 from django.db.models import Max
 from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 
 from analysis.models import (
     AnalysisTask,
     GroupedImages,
+    ListingResult,
+    LLMCall,
+    LLMResponse,
     MergedPropertyImage,
     MergedSampleImage,
     Prompt,
@@ -13,6 +17,8 @@ from analysis.models import (
     PropertyImage,
     SampleImage,
 )
+from utils.metering import summarize_llm_calls
+from utils.prompt_registry import prompt_registry
 
 
 @admin.register(Property)
@@ -65,7 +71,9 @@ class PropertyImageAdmin(admin.ModelAdmin):
     readonly_fields = ("created_at",)
 
     def image_preview(self, obj):
-        return format_html('<img src="{}" width="100" height="100" />', obj.image.url)
+        # The stored tile is a fraction of the original's size
+        preview = obj.thumbnail or obj.image
+        return format_html('<img src="{}" width="100" height="100" />', preview.url)
 
     image_preview.short_description = "Image Preview"
 
@@ -160,7 +168,7 @@ class AnalysisTaskAdmin(admin.ModelAdmin):
     )
     list_filter = ("status", "stage", "created_at", "updated_at")
     search_fields = ("property__url", "stage")
-    readonly_fields = ("created_at", "updated_at")
+    readonly_fields = ("created_at", "updated_at", "llm_usage_display")
 
     fieldsets = (
         (None, {"fields": ("property", "status", "progress", "stage")}),
@@ -171,6 +179,7 @@ class AnalysisTaskAdmin(admin.ModelAdmin):
                 "classes": ("collapse",),
             },
         ),
+        ("LLM Usage", {"fields": ("llm_usage_display",)}),
         (
             "Timestamps",
             {
@@ -187,6 +196,76 @@ class AnalysisTaskAdmin(admin.ModelAdmin):
 
     stage_progress_display.short_description = "Stage Progress"
 
+    def llm_usage_display(self, obj):
+        if not obj.pk:
+            return "N/A"
+        usage = summarize_llm_calls(obj)
+        total = usage["total"]
+        if not total["calls"]:
+            return "No LLM calls recorded"
+        rows = "".join(
+            format_html(
+                "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>${}</td><td>{}</td></tr>",
+                stage,
+                row["calls"],
+                row["cache_hits"],
+                row["prompt_tokens"] + row["completion_tokens"],
+                row["cost"],
+                row["avg_latency_ms"],
+            )
+            for stage, row in [*usage["stages"].items(), ("total", total)]
+        )
+        return format_html(
+            "<table><tr><th>Stage</th><th>Calls</th><th>Cache hits</th>"
+            "<th>Tokens</th><th>Cost</th><th>Avg latency (ms)</th></tr>{}</table>",
+            mark_safe(rows),
+        )
+
+    llm_usage_display.short_description = "LLM Usage"
+
+
+@admin.register(LLMResponse)
+class LLMResponseAdmin(admin.ModelAdmin):
+    list_display = (
+        "cache_key",
+        "model",
+        "hit_count",
+        "prompt_tokens",
+        "completion_tokens",
+        "created_at",
+        "last_used_at",
+    )
+    list_filter = ("model", "created_at")
+    search_fields = ("cache_key", "response_content")
+    readonly_fields = ("created_at", "last_used_at")
+
+
+@admin.register(LLMCall)
+class LLMCallAdmin(admin.ModelAdmin):
+    list_display = (
+        "task",
+        "stage",
+        "model",
+        "latency_ms",
+        "prompt_tokens",
+        "completion_tokens",
+        "cost",
+        "cache_hit",
+        "success",
+        "created_at",
+    )
+    list_filter = ("stage", "model", "cache_hit", "success", "created_at")
+    search_fields = ("task__id", "task__property__url")
+    readonly_fields = ("created_at",)
+    list_select_related = ("task",)
+
+
+@admin.register(ListingResult)
+class ListingResultAdmin(admin.ModelAdmin):
+    list_display = ("url", "source_property", "fingerprint", "created_at", "updated_at")
+    search_fields = ("url", "fingerprint")
+    readonly_fields = ("created_at", "updated_at")
+
 
 def revert_to_version(modeladmin, request, queryset):
     # For each selected prompt, make that version active and deactivate others of the same name
@@ -194,6 +273,7 @@ def revert_to_version(modeladmin, request, queryset):
         Prompt.objects.filter(name=prompt.name).update(is_active=False)
         prompt.is_active = True
         prompt.save()
+    prompt_registry.invalidate()
 
 
 revert_to_version.short_description = "Revert selected prompts to this version"
@@ -241,7 +321,9 @@ class PromptAdmin(admin.ModelAdmin):
                     obj.version = max_version + 1
                     obj.is_active = True
                     super().save_model(request, obj, form, False)
+                prompt_registry.invalidate()
                 return
 
         # If it's a new object or nothing changed, just save normally
         super().save_model(request, obj, form, change)
+        prompt_registry.invalidate()
@@ -3,6 +3,8 @@ from typing import Any, Dict
 
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from analysis.models import AnalysisEvent
+from analysis.progress import analysis_group_name
 from property_analysis.config.logging_config import configure_logger
 
 logger = configure_logger(__name__)
@@ -16,7 +18,8 @@ class AnalysisProgressConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         self.user = user
-        self.analysis_group_name = f"analysis_{user.id}"
+        # Same group the analysis task publishes progress and events to
+        self.analysis_group_name = analysis_group_name(user.phone)
 
         await self.channel_layer.group_add(self.analysis_group_name, self.channel_name)
 
@@ -33,6 +36,22 @@ class AnalysisProgressConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+
+        # {"action": "resume", "task_id": ..., "cursor": <last seq received>}
+        if data.get("action") == "resume":
+            try:
+                task_id = int(data.get("task_id"))
+                cursor = int(data.get("cursor") or 0)
+            except (TypeError, ValueError):
+                await self.send(
+                    text_data=json.dumps(
+                        {"type": "error", "message": "task_id and cursor must be integers"}
+                    )
+                )
+                return
+            await self.replay_events(task_id, cursor)
+            return
+
         message = data["message"]
 
         logger.info(f"=== MESSAGE RECEIVED ===")
@@ -47,3 +66,22 @@ class AnalysisProgressConsumer(AsyncWebsocketConsumer):
         await self.send(
             text_data=json.dumps({"type": "analysis_progress", "message": message})
         )
+
+    async def analysis_event(self, event):
+        await self.send(
+            text_data=json.dumps({"type": "analysis_event", **event["event"]})
+        )
+
+    async def replay_events(self, task_id, cursor):
+        events = AnalysisEvent.objects.filter(
+            task_id=task_id,
+            task__phone_number=getattr(self.user, "phone", None),
+            seq__gt=cursor,
+        ).order_by("seq")
+        replayed = 0
+        async for event in events:
+            await self.send(
+                text_data=json.dumps({"type": "analysis_event", **event.as_message()})
+            )
+            replayed += 1
+        logger.info(f"Replayed {replayed} events of task {task_id} after seq {cursor}")
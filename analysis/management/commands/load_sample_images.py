@@ -7,8 +7,15 @@ from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
 from django.db.models import Count
 
-from analysis.models import MergedSampleImage, SampleImage
-from utils.image_processing import compute_embedding, merge_images
+from analysis.models import (
+    CacheVersion,
+    MergedSampleImage,
+    SampleImage,
+    embedding_to_bytes,
+)
+from utils.embeddings import compute_embedding
+from utils.image_processing import merge_images
+from utils.sample_cache import SAMPLE_IMAGES_CACHE
 
 
 def compute_image_hash(image_path):
@@ -68,8 +75,10 @@ class Command(BaseCommand):
                                         else:
                                             # Compute embedding
                                             embedding = compute_embedding(image_path)
-                                            # Save the embedding as a list of floats
-                                            embedding_data = embedding.tolist()
+                                            # Save the embedding as raw float32 bytes
+                                            embedding_data = embedding_to_bytes(
+                                                embedding
+                                            )
 
                                             with open(image_path, "rb") as img_file:
                                                 sample_image = (
@@ -142,6 +151,9 @@ class Command(BaseCommand):
                                     )
                                 )
 
+        # Tell every worker to drop its cached sample references
+        CacheVersion.bump(SAMPLE_IMAGES_CACHE)
+
         self.stdout.write(
             self.style.SUCCESS("Sample image loading and merging completed")
         )
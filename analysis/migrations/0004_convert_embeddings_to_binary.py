@@ -0,0 +1,51 @@
+import numpy as np
+from django.db import migrations
+
+EMBEDDING_DTYPE = np.float32
+BATCH_SIZE = 500
+
+
+def _convert(apps, source_field, target_field, convert):
+    for model_name in ("PropertyImage", "SampleImage"):
+        model = apps.get_model("analysis", model_name)
+        queryset = model.objects.filter(**{f"{source_field}__isnull": False}).only(
+            "id", source_field
+        )
+        batch = []
+        for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+            setattr(obj, target_field, convert(getattr(obj, source_field)))
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, [target_field])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [target_field])
+
+
+def embeddings_to_binary(apps, schema_editor):
+    _convert(
+        apps,
+        "embedding",
+        "embedding_binary",
+        lambda embedding: np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes(),
+    )
+
+
+def embeddings_to_json(apps, schema_editor):
+    _convert(
+        apps,
+        "embedding_binary",
+        "embedding",
+        lambda data: np.frombuffer(data, dtype=EMBEDDING_DTYPE).tolist(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0003_propertyimage_embedding_binary_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(embeddings_to_binary, embeddings_to_json),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0004_convert_embeddings_to_binary'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='propertyimage',
+            name='embedding',
+        ),
+        migrations.RemoveField(
+            model_name='sampleimage',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='propertyimage',
+            old_name='embedding_binary',
+            new_name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='sampleimage',
+            old_name='embedding_binary',
+            new_name='embedding',
+        ),
+    ]
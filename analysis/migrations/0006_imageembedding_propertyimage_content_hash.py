@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-17 17:53
+
+import analysis.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0005_replace_json_embeddings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('embedding', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Image Embedding',
+                'verbose_name_plural': 'Image Embeddings',
+            },
+            bases=(analysis.models.EmbeddingMixin, models.Model),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-17 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0007_llmresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('overall_condition', models.JSONField(blank=True, null=True)),
+                ('detailed_analysis', models.JSONField(blank=True, null=True)),
+                ('overall_analysis', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source_property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listing_results', to='analysis.property')),
+            ],
+            options={
+                'verbose_name': 'Listing Result',
+                'verbose_name_plural': 'Listing Results',
+                'unique_together': {('url', 'fingerprint')},
+            },
+        ),
+    ]
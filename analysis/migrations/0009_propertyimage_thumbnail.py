@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0008_listingresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='propertyimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='property_tiles/'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0009_propertyimage_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('event_type', models.CharField(max_length=50)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='analysis.analysistask')),
+            ],
+            options={
+                'verbose_name': 'Analysis Event',
+                'verbose_name_plural': 'Analysis Events',
+                'ordering': ['task', 'seq'],
+                'unique_together': {('task', 'seq')},
+            },
+        ),
+    ]
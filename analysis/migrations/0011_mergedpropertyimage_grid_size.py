@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0010_analysisevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergedpropertyimage',
+            name='grid_size',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0012_llmcall'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='llmresponse',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,9 +1,35 @@
 import hashlib
 
+import numpy as np
 from django.db import models
+from django.db.models import F
 from django.utils.translation import gettext_lazy as _
 
 
+EMBEDDING_DTYPE = np.float32
+
+
+def embedding_to_bytes(embedding):
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_bytes(data):
+    # np.frombuffer shares memory with the DB value instead of parsing floats
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+
+class EmbeddingMixin:
+    """Accessors for models that store a CLIP embedding as raw float32 bytes."""
+
+    def get_embedding(self):
+        if self.embedding is None:
+            return None
+        return embedding_from_bytes(self.embedding)
+
+    def set_embedding(self, embedding):
+        self.embedding = embedding_to_bytes(embedding)
+
+
 class Prompt(models.Model):
     name = models.CharField(max_length=100)
     content = models.TextField()
@@ -48,11 +74,40 @@ class Property(models.Model):
         unique_together = ["url", "phone_number"]
 
 
-class PropertyImage(models.Model):
+class ListingResult(models.Model):
+    """
+    A finished analysis of a listing, keyed by its normalised URL and a
+    fingerprint of the scraped content, so other requests can reuse it.
+    """
+
+    url = models.URLField()
+    fingerprint = models.CharField(max_length=64)
+    source_property = models.ForeignKey(
+        Property, related_name="listing_results", on_delete=models.CASCADE
+    )
+    overall_condition = models.JSONField(null=True, blank=True)
+    detailed_analysis = models.JSONField(null=True, blank=True)
+    overall_analysis = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Listing Result")
+        verbose_name_plural = _("Listing Results")
+        unique_together = ["url", "fingerprint"]
+
+    def __str__(self):
+        return f"{self.url} ({self.fingerprint[:12]})"
+
+
+class PropertyImage(EmbeddingMixin, models.Model):
     property = models.ForeignKey(
         Property, related_name="images", on_delete=models.CASCADE
     )
     image = models.ImageField(upload_to="property_images/")
+    thumbnail = models.ImageField(
+        upload_to="property_tiles/", blank=True
+    )  # 256x256 letterboxed tile, used for grids and previews
     original_url = models.URLField()
     main_category = models.CharField(
         max_length=100
@@ -66,7 +121,10 @@ class PropertyImage(models.Model):
     condition_label = models.CharField(max_length=100, blank=True)
     condition_score = models.IntegerField(null=True, blank=True)
     reasoning = models.TextField(blank=True)
-    embedding = models.JSONField(null=True, editable=False)
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True, editable=False
+    )  # SHA-256 of the downloaded bytes
+    embedding = models.BinaryField(null=True, editable=False)
     similarity_scores = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -97,6 +155,7 @@ class MergedPropertyImage(models.Model):
     image = models.ImageField(upload_to="merged_property_images/")
     main_category = models.CharField(max_length=100)  # e.g., "internal_living_spaces"
     sub_category = models.CharField(max_length=100)
+    grid_size = models.PositiveSmallIntegerField(default=2)  # 2 for a 2x2 grid
     created_at = models.DateTimeField(auto_now_add=True)
     images = models.ManyToManyField(PropertyImage)
 
@@ -106,13 +165,13 @@ class MergedPropertyImage(models.Model):
         # unique_together = ('property', 'main_category', 'sub_category')
 
 
-class SampleImage(models.Model):
+class SampleImage(EmbeddingMixin, models.Model):
     category = models.CharField(max_length=100)  # e.g., "internal"
     subcategory = models.CharField(max_length=100)  # e.g., "living_spaces"
     condition = models.CharField(max_length=100)  # e.g., "excellent"
     image = models.ImageField(upload_to="sample_images/")
     image_hash = models.CharField(max_length=32, unique=True, editable=False)
-    embedding = models.JSONField(null=True, editable=False)
+    embedding = models.BinaryField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -168,3 +227,117 @@ class AnalysisTask(models.Model):
     class Meta:
         verbose_name = _("Analysis Task")
         verbose_name_plural = _("Analysis Tasks")
+
+
+class AnalysisEvent(models.Model):
+    """
+    Partial results streamed to the client while a task runs. seq orders the
+    events of one task and is the cursor a reconnecting client resumes from.
+    """
+
+    task = models.ForeignKey(
+        AnalysisTask, related_name="events", on_delete=models.CASCADE
+    )
+    seq = models.PositiveIntegerField()
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Analysis Event")
+        verbose_name_plural = _("Analysis Events")
+        unique_together = ["task", "seq"]
+        ordering = ["task", "seq"]
+
+    def as_message(self):
+        return {
+            "task_id": self.task_id,
+            "seq": self.seq,
+            "event_type": self.event_type,
+            "payload": self.payload,
+        }
+
+
+class LLMCall(models.Model):
+    """One OpenAI call (or LLM cache hit), attributed to the task and stage that made it."""
+
+    task = models.ForeignKey(
+        AnalysisTask,
+        related_name="llm_calls",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    stage = models.CharField(max_length=50, blank=True, db_index=True)
+    model = models.CharField(max_length=50)
+    latency_ms = models.FloatField(default=0.0)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    cost = models.FloatField(default=0.0)  # USD
+    cache_hit = models.BooleanField(default=False)
+    success = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("LLM Call")
+        verbose_name_plural = _("LLM Calls")
+
+
+class ImageEmbedding(EmbeddingMixin, models.Model):
+    """CLIP embeddings keyed by the SHA-256 of the image bytes they were computed from."""
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    embedding = models.BinaryField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Image Embedding")
+        verbose_name_plural = _("Image Embeddings")
+
+    def __str__(self):
+        return self.content_hash
+
+
+class LLMResponse(models.Model):
+    """Cached OpenAI responses, keyed by model, prompt and image contents."""
+
+    cache_key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    response_content = models.TextField()
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("LLM Response")
+        verbose_name_plural = _("LLM Responses")
+
+    def __str__(self):
+        return f"{self.model} ({self.cache_key[:12]})"
+
+
+class CacheVersion(models.Model):
+    """Version counters used to invalidate in-process caches in every worker."""
+
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Cache Version")
+        verbose_name_plural = _("Cache Versions")
+
+    def __str__(self):
+        return f"{self.name} (v{self.version})"
+
+    @classmethod
+    def get_version(cls, name):
+        version = cls.objects.filter(name=name).values_list("version", flat=True)
+        return version.first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(version=F("version") + 1)
@@ -0,0 +1,157 @@
+import asyncio
+import re
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from analysis.models import AnalysisEvent, AnalysisTask
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+TERMINAL_STAGES = ("complete", "error")
+
+
+def analysis_group_name(phone_number):
+    """Channels group of a user's analyses, joined by their WebSocket consumer."""
+    # Group names may only contain ASCII letters, digits, hyphens, underscores and periods
+    return f"analysis_{re.sub(r'[^0-9A-Za-z_.-]', '', str(phone_number))}"
+
+
+class ProgressPublisher:
+    """
+    Publishes the progress of one AnalysisTask to the database and the
+    user's WebSocket group. Updates arriving within `interval` seconds of the
+    last publish are coalesced into one, and the latest is published when the
+    interval ends. Stage changes and terminal stages are published at once.
+    Only the task columns that changed are written. Call flush() before the
+    task returns so an update still waiting for its interval is not lost.
+
+    Partial results go through publish_event. They are never coalesced, and
+    are stored as AnalysisEvents so reconnecting clients can replay them.
+    """
+
+    def __init__(self, task_instance, phone_number, source, channel_layer, interval=None):
+        self.task_instance = task_instance
+        self.phone_number = phone_number
+        self.source = source
+        self.channel_layer = channel_layer
+        self.interval = (
+            settings.PROGRESS_PUBLISH_INTERVAL if interval is None else interval
+        )
+        self.published_events = 0
+        self.coalesced_events = 0
+        self._event_seq = 0
+        self._pending = None
+        self._last_publish = None
+        self._flush_handle = None
+        self._lock = asyncio.Lock()
+        self._event_lock = asyncio.Lock()
+        self._saved = self._snapshot()
+
+    async def __call__(self, stage, message, progress):
+        stage_changed = stage != self.task_instance.stage
+        self.task_instance.status = stage
+        self.task_instance.progress = progress
+        self.task_instance.stage = stage
+        self.task_instance.stage_progress[stage] = progress
+
+        if self._pending is not None:
+            self.coalesced_events += 1
+        self._pending = (stage, message, progress)
+
+        now = time.monotonic()
+        if (
+            stage_changed
+            or stage in TERMINAL_STAGES
+            or self._last_publish is None
+            or now - self._last_publish >= self.interval
+        ):
+            await self.flush()
+        elif self._flush_handle is None:
+            delay = self.interval - (now - self._last_publish)
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                delay, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        async with self._lock:
+            if self._pending is None:
+                return
+            stage, message, progress = self._pending
+            self._pending = None
+            self._last_publish = time.monotonic()
+            self.published_events += 1
+
+            # Write exactly this snapshot: updates arriving while the query
+            # runs differ from it, so the next flush picks them up
+            snapshot = self._snapshot()
+            changed = {
+                field: value
+                for field, value in snapshot.items()
+                if self._saved[field] != value
+            }
+            if changed:
+                await AnalysisTask.objects.filter(pk=self.task_instance.pk).aupdate(
+                    **changed, updated_at=timezone.now()
+                )
+                self._saved = snapshot
+
+            await self._send(stage, message, progress)
+
+        if stage in TERMINAL_STAGES:
+            logger.info(
+                f"Progress of task {self.task_instance.id}: {self.published_events} "
+                f"updates published, {self.coalesced_events} coalesced"
+            )
+
+    async def publish_event(self, event_type, payload):
+        # Numbered, stored and sent under one lock, so clients receive events in
+        # seq order and a resume cursor never skips one still in flight
+        async with self._event_lock:
+            self._event_seq += 1
+            event = await AnalysisEvent.objects.acreate(
+                task=self.task_instance,
+                seq=self._event_seq,
+                event_type=event_type,
+                payload=payload,
+            )
+            if self.source == "frontend":
+                await self.channel_layer.group_send(
+                    analysis_group_name(self.phone_number),
+                    {"type": "analysis_event", "event": event.as_message()},
+                )
+
+    def _snapshot(self):
+        return {
+            "status": self.task_instance.status,
+            "progress": self.task_instance.progress,
+            "stage": self.task_instance.stage,
+            "stage_progress": dict(self.task_instance.stage_progress),
+        }
+
+    async def _send(self, stage, message, progress):
+        if self.source == "frontend":
+            # Send progress update via WebSocket
+            await self.channel_layer.group_send(
+                analysis_group_name(self.phone_number),
+                {
+                    "type": "analysis_progress",
+                    "message": {
+                        "stage": stage,
+                        "message": message,
+                        "progress": progress,
+                    },
+                },
+            )
+        elif self.source == "whatsapp":
+            # Send progress update via WhatsApp
+            progress_message = (
+                f"Stage: {stage}\nProgress: {progress}%\nMessage: {message}"
+            )
+            # send_whatsapp_message(self.phone_number, progress_message)
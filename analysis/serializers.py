@@ -9,6 +9,7 @@ class PropertyImageSerializer(serializers.ModelSerializer):
         fields = [
             "id",
             "image",
+            "thumbnail",
             "original_url",
             "main_category",
             "sub_category",
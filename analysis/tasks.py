@@ -2,7 +2,7 @@ import ssl
 
 import aiohttp
 import requests
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from celery import shared_task
 from channels.layers import get_channel_layer
 from decouple import config
@@ -12,14 +12,28 @@ from accounts.models import UserToken
 from analysis.models import (
     AnalysisTask,
     GroupedImages,
+    ListingResult,
     MergedPropertyImage,
     Property,
     PropertyImage,
 )
+from analysis.progress import ProgressPublisher
+from property_analysis.config.base_config import close_async_openai_client
 from property_analysis.config.logging_config import configure_logger
-from utils.image_processing import download_images
-from utils.openai_analysis import get_openai_chat_response
+from utils.embedding_cache import close_redis_client
+from utils.image_processing import download_images, prune_property_images
+from utils.listing_results import (
+    clone_listing_result,
+    compute_listing_fingerprint,
+    find_listing_result,
+    is_complete_analysis,
+    listing_result_summary,
+    store_listing_result,
+)
+from utils.metering import llm_stage, metered_task
+from utils.openai_analysis import get_openai_chat_response_async
 from utils.property_analysis import process_property
+from utils.working_set import ImageWorkingSet
 
 logger = configure_logger(__name__)
 
@@ -28,9 +42,20 @@ logger = configure_logger(__name__)
 # @shared_task(name="property_analysis.tasks.analyze_property", queue="analysis_queue")
 def analyze_property(property_id, task_id, phone_number, job_id, source="frontend"):
     logger.info("Starting analyze_property task...")
-    async_to_sync(analyze_property_async)(
-        property_id, task_id, phone_number, job_id, source
-    )
+    # async_to_sync runs the coroutine in a copy of this context, so every
+    # LLM call of the analysis is recorded against task_id
+    with metered_task(task_id):
+        async_to_sync(run_analysis)(property_id, task_id, phone_number, job_id, source)
+
+
+async def run_analysis(property_id, task_id, phone_number, job_id, source):
+    try:
+        await analyze_property_async(property_id, task_id, phone_number, job_id, source)
+    finally:
+        # Every task gets a fresh loop from async_to_sync, close the clients
+        # bound to this one instead of leaking their connection pools
+        await close_async_openai_client()
+        await close_redis_client()
 
 
 async def analyze_property_async(property_id, task_id, phone_number, job_id, source):
@@ -55,40 +80,10 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
 
     # await sync_to_async(clear_property_data)(property_instance)
 
-    async def update_progress(stage, message, progress):
-        logger.info(
-            f"Updating progress: Stage={stage}, Message={message}, Progress={progress}%"
-        )
-        task_instance.status = stage
-        task_instance.progress = progress
-        task_instance.stage = stage
-        task_instance.stage_progress[stage] = progress
-        await task_instance.asave()
-        logger.info("Task instance progress updated and saved.")
-
-        if source == "frontend":
-            logger.info(
-                f"Sending progress update via WebSocket to analysis_{phone_number}"
-            )
-            # Send progress update via WebSocket
-            await channel_layer.group_send(
-                f"analysis_{phone_number}",
-                {
-                    "type": "analysis_progress",
-                    "message": {
-                        "stage": stage,
-                        "message": message,
-                        "progress": progress,
-                    },
-                },
-            )
-        elif source == "whatsapp":
-            logger.info("Sending progress update via WhatsApp")
-            # Send progress update via WhatsApp
-            progress_message = (
-                f"Stage: {stage}\nProgress: {progress}%\nMessage: {message}"
-            )
-            # send_whatsapp_message(phone_number, progress_message)
+    # Coalesces the many per-image and per-batch updates into few writes
+    update_progress = ProgressPublisher(
+        task_instance, phone_number, source, channel_layer
+    )
 
     try:
         # Download images
@@ -175,6 +170,41 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
         await property_instance.asave()
         logger.info("Property instance updated and saved.")
 
+        # Reuse a finished analysis of the same listing if its content is unchanged
+        fingerprint = compute_listing_fingerprint(
+            property_instance.image_urls, property_instance.description
+        )
+        listing_result = None
+        if settings.LISTING_RESULT_REUSE_ENABLED:
+            listing_result = await sync_to_async(find_listing_result)(
+                property_instance.url, fingerprint, settings.LISTING_RESULT_MAX_AGE
+            )
+        if (
+            listing_result is not None
+            and listing_result.source_property_id != property_instance.id
+        ):
+            logger.info("Listing unchanged since its last analysis, reusing results.")
+            await sync_to_async(clone_listing_result)(
+                listing_result, property_instance, copy_listing_fields=False
+            )
+            # The clone is already written, a streaming failure must not fail the task
+            try:
+                await update_progress.publish_event(
+                    "overall_condition", {"condition": listing_result.overall_condition}
+                )
+            except Exception as e:
+                logger.error(f"Error publishing overall_condition event: {str(e)}")
+            await update_progress(
+                "complete", "Reused an existing analysis of this listing", 100.0
+            )
+            notify_user(
+                phone_number,
+                user_token,
+                property_id,
+                listing_result_summary(listing_result),
+            )
+            return
+
         # Process description and features using the grok function to create reviewed_description
         logger.info("Processing property description and features...")
         instruction = (
@@ -197,9 +227,10 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
 
         review_data = "Property instance saved."
         try:
-            reviewed_data = get_openai_chat_response(
-                instruction, message, prompt_format
-            )
+            with llm_stage("description"):
+                reviewed_data = await get_openai_chat_response_async(
+                    instruction, message, prompt_format
+                )
             logger.info(f"Received reviewed data: {reviewed_data}")
             property_instance.reviewed_description = reviewed_data[
                 "reviewed_description"
@@ -214,18 +245,37 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
             await property_instance.asave()
             logger.info(review_data)
 
+        # Images kept from a previous analysis (incremental re-analysis) are not
+        # downloaded again, and keep their category and labels
+        kept_images = await prune_property_images(property_instance)
+
+        # Photos are decoded once at download, later stages reuse these copies
+        working_set = ImageWorkingSet()
+
         logger.info("Downloading images...")
         image_ids, failed_downloads = await download_images(
-            property_instance, update_progress
+            property_instance,
+            update_progress,
+            skip_urls=kept_images.keys(),
+            working_set=working_set,
         )
         logger.info(f"Image IDs obtained: {image_ids}")
+        uncategorized_ids = [
+            image.id for image in kept_images.values() if not image.main_category
+        ]
+        image_ids = uncategorized_ids + image_ids
         logger.info(f"Failed image downloads: {failed_downloads}")
         property_instance.failed_downloads = failed_downloads
 
         # Process property
         logger.info("Processing property analysis...")
         result = await process_property(
-            property_instance.url, image_ids, update_progress, phone_number
+            property_instance.url,
+            image_ids,
+            update_progress,
+            phone_number,
+            working_set=working_set,
+            publish_event=update_progress.publish_event,
         )
         # logger.info(f"Property analysis result: {result}")
         logger.info(f"Property analysis done")
@@ -237,6 +287,10 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
         property_instance.overall_analysis = result["Overall Analysis"]
         await property_instance.asave()
         logger.info("Property instance saved with analysis results.")
+        if is_complete_analysis(result, failed_downloads):
+            await sync_to_async(store_listing_result)(property_instance, fingerprint)
+        else:
+            logger.info("Analysis is incomplete, not storing it for reuse.")
 
         logger.info("Updating task status to COMPLETED.")
         task_instance.status = "COMPLETED"
@@ -269,11 +323,19 @@ async def analyze_property_async(property_id, task_id, phone_number, job_id, sou
         property_instance.overall_condition = {"error": str(e)}
         await property_instance.asave()
         logger.info("Error handling completed.")
+    finally:
+        # Publish the update still waiting for its coalescing interval, if any
+        await update_progress.flush()
+
 
+def clear_property_data(property_instance, keep_images=False):
+    # Delete associated PropertyImage objects, unless their categories and labels
+    # are kept for an incremental re-analysis
+    if not keep_images:
+        PropertyImage.objects.filter(property=property_instance).delete()
 
-def clear_property_data(property_instance):
-    # Delete associated PropertyImage objects
-    PropertyImage.objects.filter(property=property_instance).delete()
+    # Results sourced from this property can no longer be cloned without its images
+    ListingResult.objects.filter(source_property=property_instance).delete()
 
     # Delete associated GroupedImages objects
     GroupedImages.objects.filter(property=property_instance).delete()
@@ -1,3 +1,714 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from analysis.consumers import AnalysisProgressConsumer
+from analysis.models import (
+    AnalysisEvent,
+    AnalysisTask,
+    ListingResult,
+    LLMCall,
+    LLMResponse,
+    Property,
+    Prompt,
+    PropertyImage,
+)
+from analysis.progress import ProgressPublisher
+from utils.listing_results import (
+    clone_listing_result,
+    compute_listing_fingerprint,
+    is_complete_analysis,
+)
+from utils.embeddings import EmbeddingBatcher
+from utils.grid import (
+    chunk_for_grid,
+    grid_description,
+    grid_side,
+    new_grid_stats,
+    record_grid_call,
+    summarize_grid_stats,
+)
+from utils.llm_cache import LLMResponseCache
+from utils.metering import (
+    arecord_llm_call,
+    llm_stage,
+    metered_task,
+    record_llm_call,
+    summarize_llm_calls,
+)
+from utils.prompt_registry import PromptRegistry
+from utils.similarity import condition_similarities, l2_normalize
+from utils.taxonomy import SpaceTaxonomy, TaxonomyLearner
+
+
+def structured_output(content="{}"):
+    return {
+        "response_content": content,
+        "prompt_tokens": 100,
+        "prompt_tokens_cost": 0.0005,
+        "completion_tokens": 10,
+        "completion_tokens_cost": 0.00015,
+    }
+
+
+@override_settings(
+    LLM_CACHE_ENABLED=True,
+    LLM_CACHE_TTL=3600,
+    LLM_CACHE_MAX_ENTRIES=2,
+    LLM_CACHE_EVICT_EVERY=1,
+)
+class LLMResponseCacheTests(TestCase):
+    def setUp(self):
+        self.cache = LLMResponseCache()
+
+    def test_miss_then_hit(self):
+        key = self.cache.make_key("gpt-4o", "prompt", ["image"])
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.set(key, "gpt-4o", structured_output('{"images": []}'))
+        cached = self.cache.get(key)
+
+        self.assertEqual(cached["response_content"], '{"images": []}')
+        self.assertTrue(cached["cache_hit"])
+        self.assertEqual(cached["prompt_tokens_cost"], 0)
+        self.assertEqual(LLMResponse.objects.get(cache_key=key).hit_count, 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_key_depends_on_prompt_and_images(self):
+        key = self.cache.make_key("gpt-4o", "prompt", ["image"])
+        self.assertNotEqual(key, self.cache.make_key("gpt-4o", "other", ["image"]))
+        self.assertNotEqual(key, self.cache.make_key("gpt-4o", "prompt", ["other"]))
+
+    def test_errors_are_not_cached(self):
+        key = self.cache.make_key("gpt-4o", "prompt", ["image"])
+        self.cache.set(key, "gpt-4o", {"error": "boom"})
+        self.assertFalse(LLMResponse.objects.exists())
+
+    def test_expired_entry_is_a_miss(self):
+        key = self.cache.make_key("gpt-4o", "prompt", ["image"])
+        self.cache.set(key, "gpt-4o", structured_output())
+        LLMResponse.objects.update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(LLMResponse.objects.exists())
+
+    def test_evicts_least_recently_used(self):
+        now = timezone.now()
+        keys = [self.cache.make_key("gpt-4o", f"prompt {i}", []) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.set(key, "gpt-4o", structured_output())
+            LLMResponse.objects.filter(cache_key=key).update(
+                last_used_at=now - timedelta(minutes=10 - i)
+            )
+        self.cache.evict()
+
+        self.assertEqual(
+            set(LLMResponse.objects.values_list("cache_key", flat=True)),
+            set(keys[1:]),
+        )
+
+    @override_settings(LLM_CACHE_EVICT_EVERY=3)
+    def test_eviction_runs_every_n_writes(self):
+        keys = [self.cache.make_key("gpt-4o", f"prompt {i}", []) for i in range(3)]
+        for key in keys[:2]:
+            self.cache.set(key, "gpt-4o", structured_output())
+        LLMResponse.objects.update(created_at=timezone.now() - timedelta(hours=2))
+
+        # The third write triggers eviction of the two expired entries
+        self.assertEqual(LLMResponse.objects.count(), 2)
+        self.cache.set(keys[2], "gpt-4o", structured_output())
+        self.assertEqual(
+            list(LLMResponse.objects.values_list("cache_key", flat=True)), [keys[2]]
+        )
+
+
+class CloneListingResultTests(TestCase):
+    def test_cloned_analysis_points_at_cloned_images(self):
+        source = Property.objects.create(url="https://rightmove.com/1", phone_number="1")
+        image = PropertyImage.objects.create(
+            property=source,
+            image="property_images/a.jpg",
+            original_url="https://img/a.jpg",
+            condition_label="Good",
+        )
+        detailed_analysis = {
+            "living_space": [{"image_id": image.id, "image_url": image.image.url}]
+        }
+        listing_result = ListingResult.objects.create(
+            url=source.url,
+            fingerprint=compute_listing_fingerprint(["https://img/a.jpg"], ""),
+            source_property=source,
+            detailed_analysis=detailed_analysis,
+            overall_analysis={"stages": {"detailed_analysis": detailed_analysis}},
+        )
+        target = Property.objects.create(url=source.url, phone_number="2")
+
+        clone_listing_result(listing_result, target)
+
+        clone = PropertyImage.objects.get(property=target)
+        target.refresh_from_db()
+        self.assertNotEqual(clone.id, image.id)
+        self.assertEqual(target.detailed_analysis["living_space"][0]["image_id"], clone.id)
+        self.assertEqual(
+            target.overall_analysis["stages"]["detailed_analysis"]["living_space"][0][
+                "image_id"
+            ],
+            clone.id,
+        )
+        # The stored result is left untouched for other clones
+        listing_result.refresh_from_db()
+        self.assertEqual(
+            listing_result.detailed_analysis["living_space"][0]["image_id"], image.id
+        )
+
+
+class IsCompleteAnalysisTests(TestCase):
+    def result(self, condition=None, failed_batches=0, failed_groups=0):
+        return {
+            "Condition": condition or {"overall_condition_label": "Average"},
+            "Overall Analysis": {
+                "Image_Analysis": {
+                    "categorization": {"failed_batches": failed_batches},
+                    "labelling": {"failed_groups": failed_groups},
+                }
+            },
+        }
+
+    def test_complete(self):
+        self.assertTrue(is_complete_analysis(self.result()))
+
+    def test_partial_results_are_not_reusable(self):
+        self.assertFalse(is_complete_analysis(self.result(failed_batches=1)))
+        self.assertFalse(is_complete_analysis(self.result(failed_groups=1)))
+        self.assertFalse(
+            is_complete_analysis(self.result(), [(0, "https://img/0.jpg", "timeout")])
+        )
+
+    def test_insufficient_data_is_not_reusable(self):
+        result = self.result()
+        result["Condition"] = "Insufficient data"
+        self.assertFalse(is_complete_analysis(result))
+
+
+@override_settings(IMAGE_DOWNLOAD_CONCURRENCY=4, IMAGE_DOWNLOAD_PER_HOST_LIMIT=4)
+class DownloadImagesTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.property = Property.objects.create(
+            url="https://rightmove.com/1",
+            phone_number="1",
+            image_urls=[f"https://img/{i}.jpg" for i in range(4)],
+        )
+
+    async def download(self, **kwargs):
+        from utils import image_processing
+
+        update_progress = mock.AsyncMock()
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch.object(
+            image_processing,
+            "download_with_requests",
+            mock.AsyncMock(side_effect=lambda url, session: url.encode()),
+        ), mock.patch.object(
+            image_processing,
+            "decode_with_tile",
+            side_effect=lambda content: (
+                (None, None, None) if b"broken" in content else (object(), None, None)
+            ),
+        ), mock.patch.object(
+            image_processing, "store_image_embeddings", mock.AsyncMock()
+        ):
+            result = await image_processing.download_images(
+                self.property, update_progress, **kwargs
+            )
+        return result, update_progress
+
+    async def test_skip_urls_only_downloads_new_images(self):
+        # The new photos sit at the end of the listing, past the number of new URLs
+        (image_ids, failed_downloads), update_progress = await self.download(
+            skip_urls=["https://img/0.jpg", "https://img/1.jpg"]
+        )
+
+        self.assertEqual(failed_downloads, [])
+        self.assertEqual(len(image_ids), 2)
+        original_urls = [
+            image.original_url
+            async for image in PropertyImage.objects.filter(id__in=image_ids).order_by(
+                "id"
+            )
+        ]
+        self.assertCountEqual(original_urls, ["https://img/2.jpg", "https://img/3.jpg"])
+        self.assertEqual(
+            await PropertyImage.objects.filter(property=self.property).acount(), 2
+        )
+        # Progress is counted over the new images only
+        self.assertEqual(update_progress.await_args_list[-1].args[2], 100)
+
+    async def test_undecodable_image_is_a_failed_download(self):
+        self.property.image_urls[1] = "https://img/broken.jpg"
+
+        (image_ids, failed_downloads), _ = await self.download(retry_delay=0)
+
+        self.assertEqual(len(image_ids), 3)
+        self.assertEqual(
+            [(idx, url) for idx, url, _ in failed_downloads],
+            [(1, "https://img/broken.jpg")],
+        )
+        self.assertFalse(
+            await PropertyImage.objects.filter(
+                original_url="https://img/broken.jpg"
+            ).aexists()
+        )
+
+    async def test_image_ids_follow_listing_order(self):
+        (image_ids, failed_downloads), _ = await self.download()
+
+        self.assertEqual(failed_downloads, [])
+        images = await PropertyImage.objects.ain_bulk(image_ids)
+        self.assertEqual(
+            [images[image_id].original_url for image_id in image_ids],
+            self.property.image_urls,
+        )
+
+
+class ProgressPublisherTests(TestCase):
+    def setUp(self):
+        self.property = Property.objects.create(url="https://rightmove.com/1", phone_number="1")
+        self.task = AnalysisTask.objects.create(property=self.property, phone_number="1")
+        self.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+
+    def publisher(self, interval=60):
+        return ProgressPublisher(
+            self.task, "1", "frontend", self.channel_layer, interval=interval
+        )
+
+    def sent_stages(self):
+        return [
+            call.args[1]["message"]["stage"]
+            for call in self.channel_layer.group_send.await_args_list
+        ]
+
+    async def test_updates_within_interval_are_coalesced(self):
+        update_progress = self.publisher()
+        await update_progress("download", "Downloading images", 0)
+        for i in range(1, 10):
+            await update_progress("download", f"Downloaded image {i}", i * 10)
+
+        self.assertEqual(update_progress.published_events, 1)
+        self.assertEqual(update_progress.coalesced_events, 8)
+
+        await update_progress.flush()
+        self.assertEqual(update_progress.published_events, 2)
+        task = await AnalysisTask.objects.aget(pk=self.task.pk)
+        self.assertEqual(task.progress, 90)
+
+    async def test_stage_changes_and_terminal_stages_publish_at_once(self):
+        update_progress = self.publisher()
+        await update_progress("download", "Downloading images", 0)
+        await update_progress("download", "Downloaded image 1", 50)
+        await update_progress("categorization", "Categorizing", 0)
+        await update_progress("complete", "Analysis completed successfully", 100)
+
+        self.assertEqual(self.sent_stages(), ["download", "categorization", "complete"])
+        task = await AnalysisTask.objects.aget(pk=self.task.pk)
+        self.assertEqual(task.status, "complete")
+        self.assertEqual(task.stage_progress["categorization"], 0)
+
+    async def test_events_are_sent_in_seq_order(self):
+        update_progress = self.publisher()
+        await asyncio.gather(
+            *(
+                update_progress.publish_event("image_categorized", {"image_id": i})
+                for i in range(5)
+            )
+        )
+        sent = [
+            call.args[1]["event"]["seq"]
+            for call in self.channel_layer.group_send.await_args_list
+        ]
+        self.assertEqual(sent, [1, 2, 3, 4, 5])
+        self.assertEqual(
+            self.channel_layer.group_send.await_args_list[0].args[0], "analysis_1"
+        )
+
+    async def test_update_during_write_is_saved_by_next_flush(self):
+        update_progress = self.publisher()
+        original_aupdate = QuerySet.aupdate
+
+        async def aupdate_and_progress(queryset, **kwargs):
+            # A coalesced update changes the task while the previous one is written
+            if kwargs.get("stage") == "categorization":
+                self.task.progress = 50
+                self.task.stage_progress["categorization"] = 50
+                update_progress._pending = ("categorization", "Categorized batch 1", 50)
+            return await original_aupdate(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "aupdate", aupdate_and_progress):
+            await update_progress("categorization", "Categorizing", 0)
+        await update_progress.flush()
+
+        task = await AnalysisTask.objects.aget(pk=self.task.pk)
+        self.assertEqual(task.progress, 50)
+        self.assertEqual(task.stage_progress["categorization"], 50)
+
+
+class ReplayEventsTests(TestCase):
+    def setUp(self):
+        self.property = Property.objects.create(url="https://rightmove.com/1", phone_number="1")
+        self.task = AnalysisTask.objects.create(property=self.property, phone_number="1")
+        for seq in range(1, 4):
+            AnalysisEvent.objects.create(
+                task=self.task, seq=seq, event_type="image_categorized", payload={}
+            )
+        self.consumer = AnalysisProgressConsumer()
+        self.consumer.user = mock.Mock(phone="1")
+        self.consumer.send = mock.AsyncMock()
+
+    async def resume(self, **data):
+        await self.consumer.receive(json.dumps({"action": "resume", **data}))
+        return [
+            json.loads(call.kwargs["text_data"])
+            for call in self.consumer.send.await_args_list
+        ]
+
+    async def test_replays_events_after_cursor(self):
+        messages = await self.resume(task_id=self.task.id, cursor=1)
+        self.assertEqual([message["seq"] for message in messages], [2, 3])
+
+    async def test_cursor_may_be_a_string(self):
+        messages = await self.resume(task_id=str(self.task.id), cursor="2")
+        self.assertEqual([message["seq"] for message in messages], [3])
+
+    async def test_missing_cursor_replays_everything(self):
+        messages = await self.resume(task_id=self.task.id)
+        self.assertEqual([message["seq"] for message in messages], [1, 2, 3])
+
+    async def test_invalid_cursor_is_rejected(self):
+        messages = await self.resume(task_id=self.task.id, cursor="latest")
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["type"], "error")
+
+    async def test_other_users_events_are_not_replayed(self):
+        self.consumer.user = mock.Mock(phone="2")
+        messages = await self.resume(task_id=self.task.id, cursor=0)
+        self.assertEqual(messages, [])
+
+
+@override_settings(LLM_METERING_ENABLED=True)
+class LLMMeteringTests(TestCase):
+    def setUp(self):
+        self.property = Property.objects.create(url="https://rightmove.com/1", phone_number="1")
+        self.task = AnalysisTask.objects.create(property=self.property, phone_number="1")
+
+    def test_calls_are_attributed_to_task_and_stage(self):
+        with metered_task(self.task.id), llm_stage("description"):
+            record_llm_call(
+                "gpt-4o-mini", 0.5, {"prompt_tokens": 1000, "completion_tokens": 100}
+            )
+        record_llm_call("gpt-4o-mini", 0.1)
+
+        call = LLMCall.objects.get(task=self.task)
+        self.assertEqual(call.stage, "description")
+        self.assertEqual(call.latency_ms, 500)
+        self.assertAlmostEqual(call.cost, (1000 * 0.15 + 100 * 0.6) / 1000000)
+        self.assertEqual(LLMCall.objects.filter(task__isnull=True).count(), 1)
+
+    async def test_stage_is_copied_into_gathered_tasks(self):
+        with metered_task(self.task.id), llm_stage("categorization"):
+            await asyncio.gather(
+                *(
+                    arecord_llm_call(
+                        "gpt-4o", 0.2, structured_output(), cache_hit=i == 0
+                    )
+                    for i in range(3)
+                )
+            )
+
+        usage = await sync_to_async(summarize_llm_calls)(self.task)
+        self.assertEqual(list(usage["stages"]), ["categorization"])
+        self.assertEqual(usage["total"]["calls"], 3)
+        self.assertEqual(usage["total"]["cache_hits"], 1)
+        # Cache hits cost nothing
+        self.assertEqual(usage["total"]["cost"], round(2 * 0.00065, 6))
+
+    @override_settings(LLM_METERING_ENABLED=False)
+    def test_disabled(self):
+        record_llm_call("gpt-4o", 0.1)
+        self.assertFalse(LLMCall.objects.exists())
+
+
+class ConditionSimilarityTests(SimpleTestCase):
+    def test_averages_per_condition(self):
+        samples = l2_normalize([[1, 0], [0, 1], [1, 1], [0, 0]])
+        similarities = condition_similarities(
+            [[2, 0]], samples, ["Good", "Poor", "Good", "Poor"]
+        )
+
+        self.assertEqual(list(similarities[0]), ["Good", "Poor"])
+        self.assertAlmostEqual(similarities[0]["Good"], (1 + 0.5**0.5) / 2, places=6)
+        # The zero sample has no direction and counts as 0
+        self.assertAlmostEqual(similarities[0]["Poor"], 0.0, places=6)
+
+    def test_matches_per_pair_cosine(self):
+        rng = np.random.default_rng(0)
+        targets, samples = rng.normal(size=(3, 8)), rng.normal(size=(5, 8))
+        conditions = ["A", "B", "A", "C", "B"]
+
+        similarities = condition_similarities(targets, l2_normalize(samples), conditions)
+
+        for target, result in zip(targets, similarities):
+            for condition in set(conditions):
+                expected = np.mean(
+                    [
+                        np.dot(target, sample)
+                        / (np.linalg.norm(target) * np.linalg.norm(sample))
+                        for sample, sample_condition in zip(samples, conditions)
+                        if sample_condition == condition
+                    ]
+                )
+                self.assertAlmostEqual(result[condition], expected, places=5)
+
+    def test_empty_inputs(self):
+        self.assertEqual(condition_similarities([], np.zeros((0, 2)), []), [])
+        self.assertEqual(
+            condition_similarities([[1, 0]], np.zeros((0, 2)), []), [{}]
+        )
+
+
+@override_settings(GRID_ADAPTIVE_TARGET_CALLS=2)
+class GridTests(SimpleTestCase):
+    def test_fixed_layouts(self):
+        self.assertEqual(grid_side("3x3", 100), 3)
+        with self.assertRaises(ValueError):
+            grid_side("5x5", 10)
+
+    def test_adaptive_picks_smallest_grid_within_target_calls(self):
+        self.assertEqual(grid_side("adaptive", 8), 2)
+        self.assertEqual(grid_side("adaptive", 9), 3)
+        self.assertEqual(grid_side("adaptive", 19), 4)
+        # Too many photos for the target, the largest grid is the best it can do
+        self.assertEqual(grid_side("adaptive", 100), 4)
+
+    def test_chunks_fill_one_grid_each(self):
+        side, chunks = chunk_for_grid(list(range(10)), "3x3")
+        self.assertEqual(side, 3)
+        self.assertEqual(chunks, [list(range(9)), [9]])
+
+    def test_description(self):
+        self.assertEqual(grid_description(2, 4), "")
+        self.assertIn("3x3 grid of 7 photos", grid_description(3, 7))
+
+    def test_stats(self):
+        stats = new_grid_stats("adaptive")
+        record_grid_call(stats, 3, 9, 8, structured_output())
+        record_grid_call(stats, 2, 3, 3, dict(structured_output(), cache_hit=True))
+        record_grid_call(stats, 2, 4, 0, None)
+
+        summary = summarize_grid_stats(stats)
+        self.assertEqual(summary["calls"], 3)
+        self.assertEqual(summary["grid_sizes"], {"3x3": 1, "2x2": 2})
+        self.assertEqual(summary["cache_hits"], 1)
+        self.assertEqual(summary["coverage"], round(11 / 16, 4))
+        self.assertEqual(summary["tokens_per_image"], round(2 * 110 / 16, 1))
+
+    def test_stats_without_calls(self):
+        summary = summarize_grid_stats(new_grid_stats("2x2"))
+        self.assertIsNone(summary["coverage"])
+        self.assertIsNone(summary["tokens_per_image"])
+
+
+class SpaceTaxonomyTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "data.json")
+        self.write(
+            {
+                "living_space": ["Kitchen", "Bedroom"],
+                "front_garden_space": ["Front Garden"],
+                "others": ["Kitchen", "Hallway"],
+            }
+        )
+        self.taxonomy = SpaceTaxonomy(self.path)
+
+    def write(self, spaces):
+        with open(self.path, "w") as f:
+            json.dump(spaces, f)
+
+    def test_index(self):
+        self.assertEqual(self.taxonomy.space_key("kitchen"), "living_space")
+        self.assertEqual(self.taxonomy.space_key("HALLWAY"), "others")
+        self.assertEqual(self.taxonomy.space_key("Attic"), "others")
+        self.assertIsNone(self.taxonomy.space_key(None, default=None))
+        self.assertTrue(self.taxonomy.has_type("Kitchen", "others"))
+        self.assertFalse(self.taxonomy.has_type("Bedroom", "others"))
+
+    def test_reloads_when_the_file_changes(self):
+        version = self.taxonomy.version
+        self.write({"others": ["Attic", "Kitchen"], "living_space": ["Kitchen"]})
+
+        self.assertNotEqual(self.taxonomy.version, version)
+        self.assertEqual(self.taxonomy.space_key("Kitchen"), "others")
+        self.assertFalse(self.taxonomy.has_type("Bedroom"))
+
+    def test_learner(self):
+        learner = TaxonomyLearner(self.taxonomy)
+        learner.learn(
+            {
+                "images": [
+                    {"category": "internal", "details": {"room_type": "Study"}},
+                    {"category": "internal", "details": {"room_type": "kitchen"}},
+                    {"category": "external", "details": {"exterior_type": "Patio"}},
+                    {"category": "floor plan", "details": {"floor_type": "Ground"}},
+                    {"category": "others", "details": {"others": "hallway"}},
+                    {"category": "others", "details": {"others": ["not", "a type"]}},
+                ]
+            }
+        )
+
+        self.assertEqual(
+            learner.learned,
+            {
+                "living_space": {"Study"},
+                "front_garden_space": {"Patio"},
+                "others": {"Ground"},
+            },
+        )
+        self.assertEqual(learner.space_key("study"), "living_space")
+        self.assertEqual(learner.space_key("Kitchen"), "living_space")
+
+    def test_persist_merges_with_concurrent_additions(self):
+        learner = TaxonomyLearner(self.taxonomy)
+        learner.learn({"images": [{"category": "others", "details": {"others": "Loft"}}]})
+        # Another worker persisted its own types in the meantime
+        with open(self.path) as f:
+            spaces = json.load(f)
+        spaces["others"].append("Cellar")
+        self.write(spaces)
+
+        learner.persist()
+
+        with open(self.path) as f:
+            spaces = json.load(f)
+        self.assertEqual(spaces["others"], ["Kitchen", "Hallway", "Cellar", "Loft"])
+        self.assertEqual(self.taxonomy.space_key("loft"), "others")
+        self.assertEqual(learner.learned, {})
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.path))),
+            ["data.json", "data.json.lock"],
+        )
+
+
+@override_settings(PROMPT_CACHE_MAX_ENTRIES=2, PROMPT_CACHE_REVALIDATE_INTERVAL=0)
+class PromptRegistryTests(TestCase):
+    def setUp(self):
+        Prompt.objects.create(name="labelling", content="v1", version=1)
+        Prompt.objects.create(name="labelling", content="v2", version=2)
+        Prompt.objects.create(name="labelling", content="v3", version=3, is_active=False)
+
+    def test_active_prompt_with_highest_version(self):
+        registry = PromptRegistry()
+        self.assertEqual(registry.get_content("labelling"), "v2")
+        self.assertEqual(registry.get_content("missing"), "")
+
+    def test_cached_until_invalidated(self):
+        registry = PromptRegistry()
+        registry.get("labelling")
+        Prompt.objects.filter(version=3).update(is_active=True)
+
+        with self.assertNumQueries(1):
+            # Only the version check, the prompt comes from the cache
+            self.assertEqual(registry.get_content("labelling"), "v2")
+
+        registry.invalidate()
+        self.assertEqual(registry.get_content("labelling"), "v3")
+
+    def test_invalidation_reaches_other_processes(self):
+        worker, admin = PromptRegistry(), PromptRegistry()
+        self.assertEqual(worker.get_content("labelling"), "v2")
+
+        Prompt.objects.filter(version=3).update(is_active=True)
+        admin.invalidate()
+
+        self.assertEqual(worker.get_content("labelling"), "v3")
+
+    @override_settings(PROMPT_CACHE_REVALIDATE_INTERVAL=3600)
+    def test_version_checked_once_per_interval(self):
+        worker = PromptRegistry()
+        worker.get("labelling")
+        PromptRegistry().invalidate()
+
+        with self.assertNumQueries(0):
+            worker.get("labelling")
+
+    @override_settings(PROMPT_CACHE_REVALIDATE_INTERVAL=3600)
+    def test_lru_eviction(self):
+        registry = PromptRegistry()
+        for name in ("labelling", "description", "condition"):
+            registry.get(name)
+
+        with self.assertNumQueries(1):
+            # "labelling" was evicted, so it is loaded again
+            registry.get("condition")
+            registry.get("labelling")
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+        def sync_compute_embeddings(contents):
+            self.batches.append(list(contents))
+            if any(content.startswith(b"bad") for content in contents):
+                raise ValueError("cannot identify image file")
+            return np.array([[len(content), 0.0] for content in contents])
+
+        patcher = mock.patch(
+            "utils.embeddings.sync_compute_embeddings",
+            side_effect=sync_compute_embeddings,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_flushes_full_batches(self):
+        batcher = EmbeddingBatcher(max_batch_size=2, flush_timeout=60)
+        embeddings = await asyncio.gather(
+            *(batcher.embed(b"x" * n) for n in (1, 2, 3, 4))
+        )
+
+        self.assertEqual([embedding[0] for embedding in embeddings], [1, 2, 3, 4])
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2])
+
+    async def test_flushes_partial_batch_after_timeout(self):
+        batcher = EmbeddingBatcher(max_batch_size=8, flush_timeout=0.01)
+        embeddings = await asyncio.gather(batcher.embed(b"a"), batcher.embed(b"bb"))
+
+        self.assertEqual([embedding[0] for embedding in embeddings], [1, 2])
+        self.assertEqual(self.batches, [[b"a", b"bb"]])
+
+    async def test_errors_reach_only_their_waiter(self):
+        batcher = EmbeddingBatcher(max_batch_size=3, flush_timeout=60)
+        results = await asyncio.gather(
+            batcher.embed(b"a"),
+            batcher.embed(b"bad"),
+            batcher.embed(b"ccc"),
+            return_exceptions=True,
+        )
+
+        self.assertEqual(results[0][0], 1)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2][0], 3)
+        # The failed batch was retried image by image
+        self.assertEqual(len(self.batches), 4)
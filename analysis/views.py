@@ -16,6 +16,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from analysis.models import AnalysisTask, Prompt, Property, PropertyImage
+from analysis.progress import analysis_group_name
 from analysis.serializers import (
     AnalysisTaskSerializer,
     PromptUpdateSerializer,
@@ -24,13 +25,29 @@ from analysis.serializers import (
 )
 from analysis.tasks import analyze_property, clear_property_data
 from property_analysis.config.logging_config import configure_logger
+from utils.listing_results import (
+    clone_listing_result,
+    compute_listing_fingerprint,
+    find_listing_result,
+)
+from utils.metering import llm_stage, summarize_llm_calls
 from utils.openai_analysis import get_openai_chat_response
+from utils.prompt_registry import prompt_registry
 
 # from analysis.messaging import send_whatsapp_message
 
 logger = configure_logger(__name__)
 
 
+def parse_flag(value, default=False):
+    """Boolean request field, sent as JSON or as a form string."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
 class PropertyViewSet(viewsets.ModelViewSet):
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
@@ -86,7 +103,10 @@ class PropertyViewSet(viewsets.ModelViewSet):
                 "required": ["url"],
                 "additionalProperties": False,
             }
-            url_response = get_openai_chat_response(instruction, message, prompt_format)
+            with llm_stage("url_extraction"):
+                url_response = get_openai_chat_response(
+                    instruction, message, prompt_format
+                )
             url = (
                 url_response.get("url")
                 if isinstance(url_response, dict)
@@ -142,8 +162,60 @@ class PropertyViewSet(viewsets.ModelViewSet):
                 url=url, phone_number=phone_number
             )
 
+        # Serve a recent analysis of the same listing without scraping it again,
+        # when the client asks for it ("reuse") or when the listing data this
+        # property already has is the data that was analysed. Re-analysing the
+        # source property itself always scrapes again, the listing may have changed.
+        listing_result = None
+        if settings.LISTING_RESULT_REUSE_ENABLED:
+            listing_result = find_listing_result(
+                url, max_age=settings.LISTING_RESULT_FRESHNESS
+            )
+        if listing_result is not None and not parse_flag(request.data.get("reuse")):
+            known_fingerprint = compute_listing_fingerprint(
+                property_instance.image_urls, property_instance.description
+            )
+            if (
+                listing_result.source_property_id == property_instance.id
+                or not property_instance.image_urls
+                or known_fingerprint != listing_result.fingerprint
+            ):
+                listing_result = None
+        if listing_result is not None:
+            if listing_result.source_property_id == property_instance.id:
+                AnalysisTask.objects.filter(property=property_instance).delete()
+            else:
+                clear_property_data(property_instance)
+                clone_listing_result(listing_result, property_instance)
+
+            task = AnalysisTask.objects.create(
+                property=property_instance,
+                phone_number=phone_number,
+                status="complete",
+                progress=100.0,
+                stage="complete",
+                stage_progress={"complete": 100.0},
+            )
+            logger.info(
+                f"Reused analysis of {url} from {listing_result.updated_at.isoformat()}"
+            )
+            return Response(
+                {
+                    "task_id": task.id,
+                    "property_id": property_instance.id,
+                    "status": "complete",
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        # Incremental re-analysis keeps the analysed images and only processes
+        # the ones added to the listing since
+        incremental = parse_flag(
+            request.data.get("incremental"), settings.INCREMENTAL_REANALYSIS
+        )
+
         # Clear existing data
-        clear_property_data(property_instance)
+        clear_property_data(property_instance, keep_images=incremental)
 
         task = AnalysisTask.objects.create(
             property=property_instance, phone_number=phone_number
@@ -270,6 +342,24 @@ class PropertyViewSet(viewsets.ModelViewSet):
         serializer = AnalysisTaskSerializer(task)
         return Response(serializer.data)
 
+    @action(detail=True, methods=["get"])
+    def llm_usage(self, request, pk=None):
+        """LLM calls, tokens, cost and latency of the latest analysis, or of ?task_id=."""
+        property_instance = self.get_object()
+        task_id = request.query_params.get("task_id")
+        if task_id:
+            task = get_object_or_404(
+                AnalysisTask, id=task_id, property=property_instance
+            )
+        else:
+            task = property_instance.analysis_tasks.order_by("-created_at").first()
+            if task is None:
+                return Response(
+                    {"error": "No analysis found for this property."},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+        return Response(summarize_llm_calls(task))
+
     @action(detail=True, methods=["get"])
     def results(self, request, pk=None):
         task = get_object_or_404(AnalysisTask, id=pk)
@@ -331,7 +421,7 @@ class ScrapingCallbackView(APIView):
             # Send progress update via WebSocket
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
-                f"analysis_{phone_number}",
+                analysis_group_name(phone_number),
                 {
                     "type": "analysis_progress",
                     "message": progress_data,
@@ -415,6 +505,7 @@ class PromptUpdateView(APIView):
             version=new_version,
             is_active=True,
         )
+        prompt_registry.invalidate()
 
         return Response(
             {"message": f"Prompt {name} updated to version {new_version}."},
@@ -433,11 +524,7 @@ class GetPromptView(APIView):
             )
 
         # Fetch the active/latest version of the prompt
-        prompt = (
-            Prompt.objects.filter(name=name, is_active=True)
-            .order_by("-version")
-            .first()
-        )
+        prompt = prompt_registry.get(name)
         if not prompt:
             return Response(
                 {"error": f"No active prompt found for name: {name}"},
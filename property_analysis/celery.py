@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 from decouple import config
 from django.conf import settings
 
@@ -23,6 +24,16 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 app.conf.broker_url = config("REDIS_URL")
 
 
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    # Load CLIP in each worker process up front instead of on the first analysis
+    if not settings.CLIP_WARM_UP_ON_WORKER_START:
+        return
+    from utils.embeddings import warm_up_clip_model
+
+    warm_up_clip_model()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f"Request: {self.request!r}")
@@ -1,4 +1,36 @@
+import asyncio
+import weakref
+
+import httpx
 from django.conf import settings
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
 
 openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_openai_client():
+    # Pooled connections belong to the loop that opened them, and every Celery
+    # task runs on its own loop, so keep one client per running loop.
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
+        _async_openai_clients[loop] = client
+    return client
+
+
+async def close_async_openai_client():
+    """Release the AsyncOpenAI client and HTTP pool opened on the current event loop."""
+    client = _async_openai_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -265,6 +265,15 @@ ADMIN_PASSWORD = config("ADMIN_PASSWORD")
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 ASSISTANT_ID = config("ASSISTANT_ID")
 MODEL_NAME = config("MODEL_NAME")
+OPENAI_MAX_CONNECTIONS = config("OPENAI_MAX_CONNECTIONS", default=20, cast=int)
+# Cache of GPT-4o vision responses
+LLM_CACHE_ENABLED = config("LLM_CACHE_ENABLED", default=True, cast=bool)
+LLM_CACHE_TTL = config("LLM_CACHE_TTL", default=60 * 60 * 24 * 7, cast=int)
+LLM_CACHE_MAX_ENTRIES = config("LLM_CACHE_MAX_ENTRIES", default=10000, cast=int)
+# Expired and least recently used entries are trimmed once every this many writes
+LLM_CACHE_EVICT_EVERY = config("LLM_CACHE_EVICT_EVERY", default=100, cast=int)
+# Record latency, tokens and cost of every OpenAI call as an LLMCall
+LLM_METERING_ENABLED = config("LLM_METERING_ENABLED", default=True, cast=bool)
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
 # ==> EXTERNAL SERVICES
@@ -274,4 +283,60 @@ SCRAPER_APP_URL = config("SCRAPER_APP_URL")
 FRONTEND_APP = config("FRONTEND_APP")
 # NOTIFICATION APP
 NOTIFICATION_APP = config("NOTIFICATION_APP")
+
+# ==> ANALYSIS PIPELINE
+# CLIP embeddings
+CLIP_EMBED_BATCH_SIZE = config("CLIP_EMBED_BATCH_SIZE", default=16, cast=int)
+CLIP_EMBED_FLUSH_TIMEOUT = config("CLIP_EMBED_FLUSH_TIMEOUT", default=0.05, cast=float)
+CLIP_WARM_UP_ON_WORKER_START = config(
+    "CLIP_WARM_UP_ON_WORKER_START", default=True, cast=bool
+)
+# Optional Redis layer in front of the ImageEmbedding table, disabled when empty
+EMBEDDING_CACHE_REDIS_URL = config("EMBEDDING_CACHE_REDIS_URL", default="")
+EMBEDDING_CACHE_REDIS_TTL = config(
+    "EMBEDDING_CACHE_REDIS_TTL", default=60 * 60 * 24 * 7, cast=int
+)
+# Image downloads
+IMAGE_DOWNLOAD_CONCURRENCY = config("IMAGE_DOWNLOAD_CONCURRENCY", default=8, cast=int)
+IMAGE_DOWNLOAD_PER_HOST_LIMIT = config(
+    "IMAGE_DOWNLOAD_PER_HOST_LIMIT", default=6, cast=int
+)
+# Threads compositing image grids (PIL and cv2 release the GIL while they work)
+IMAGE_COMPOSITE_WORKERS = config("IMAGE_COMPOSITE_WORKERS", default=4, cast=int)
+# GPT-4o calls in flight per analysis
+CATEGORIZATION_CONCURRENCY = config("CATEGORIZATION_CONCURRENCY", default=4, cast=int)
+LABELLING_CONCURRENCY = config("LABELLING_CONCURRENCY", default=4, cast=int)
+LABELLING_RATE_LIMIT_RETRIES = config(
+    "LABELLING_RATE_LIMIT_RETRIES", default=3, cast=int
+)
+# Active prompts cached per process, re-checked against the prompts version counter
+PROMPT_CACHE_MAX_ENTRIES = config("PROMPT_CACHE_MAX_ENTRIES", default=32, cast=int)
+PROMPT_CACHE_REVALIDATE_INTERVAL = config(
+    "PROMPT_CACHE_REVALIDATE_INTERVAL", default=5, cast=int
+)
+# Grid layouts of the images sent to GPT-4o: "2x2", "3x3", "4x4" or "adaptive".
+# Adaptive uses the smallest grid that needs at most GRID_ADAPTIVE_TARGET_CALLS calls.
+CATEGORIZATION_GRID = config("CATEGORIZATION_GRID", default="2x2")
+LABELLING_GRID = config("LABELLING_GRID", default="2x2")
+GRID_ADAPTIVE_TARGET_CALLS = config("GRID_ADAPTIVE_TARGET_CALLS", default=3, cast=int)
+# Progress updates within this many seconds of the last one are coalesced
+PROGRESS_PUBLISH_INTERVAL = config(
+    "PROGRESS_PUBLISH_INTERVAL", default=0.25, cast=float
+)
+# Reuse finished analyses of the same listing URL. Within LISTING_RESULT_FRESHNESS
+# seconds the listing is not even scraped again; up to LISTING_RESULT_MAX_AGE seconds
+# a result is reused if the scraped images and description are unchanged.
+LISTING_RESULT_REUSE_ENABLED = config(
+    "LISTING_RESULT_REUSE_ENABLED", default=True, cast=bool
+)
+LISTING_RESULT_FRESHNESS = config(
+    "LISTING_RESULT_FRESHNESS", default=60 * 60, cast=int
+)
+LISTING_RESULT_MAX_AGE = config(
+    "LISTING_RESULT_MAX_AGE", default=60 * 60 * 24 * 7, cast=int
+)
+# Re-analyses keep the categorised and labelled images still in the listing
+# (the analyze endpoint's "incremental" field overrides this per request). Off by
+# default: kept labels are not re-checked when the prompts or taxonomy change.
+INCREMENTAL_REANALYSIS = config("INCREMENTAL_REANALYSIS", default=False, cast=bool)
 # ================================ CUSTOM VARIABLES =======================================
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import weakref
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from analysis.models import ImageEmbedding, embedding_from_bytes, embedding_to_bytes
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+REDIS_KEY_PREFIX = "image_embedding:"
+
+_redis_clients = weakref.WeakKeyDictionary()
+
+
+def compute_content_hash(image_content):
+    return hashlib.sha256(image_content).hexdigest()
+
+
+def get_redis_client():
+    """Redis client for the running loop, or None when the Redis layer is not configured."""
+    if not settings.EMBEDDING_CACHE_REDIS_URL:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _redis_clients.get(loop)
+    if client is None:
+        import redis.asyncio as redis
+
+        client = redis.from_url(settings.EMBEDDING_CACHE_REDIS_URL)
+        _redis_clients[loop] = client
+    return client
+
+
+async def close_redis_client():
+    """Drop this loop's Redis connection pool; a no-op when the cache never connected."""
+    client = _redis_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        # aclose() replaced close() in redis-py 5
+        await (getattr(client, "aclose", None) or client.close)()
+
+
+async def get_cached_embeddings(content_hashes):
+    """Returns {content_hash: embedding} for every hash that has already been embedded."""
+    content_hashes = list(dict.fromkeys(content_hashes))
+    found = {}
+
+    redis_client = get_redis_client()
+    if redis_client is not None and content_hashes:
+        try:
+            values = await redis_client.mget(
+                [REDIS_KEY_PREFIX + content_hash for content_hash in content_hashes]
+            )
+            for content_hash, value in zip(content_hashes, values):
+                if value is not None:
+                    found[content_hash] = embedding_from_bytes(value)
+        except Exception as e:
+            logger.info(f"Redis embedding cache unavailable: {str(e)}")
+
+    missing = [content_hash for content_hash in content_hashes if content_hash not in found]
+    if missing:
+        from_db = {}
+        async for cached in ImageEmbedding.objects.filter(content_hash__in=missing):
+            from_db[cached.content_hash] = cached.get_embedding()
+        found.update(from_db)
+        await _set_redis(redis_client, from_db)
+
+    logger.info(
+        f"Embedding cache: {len(found)} hits, {len(content_hashes) - len(found)} misses"
+    )
+    return found
+
+
+async def store_embeddings(embeddings):
+    """Persist {content_hash: embedding} computed for images that were not cached yet."""
+    if not embeddings:
+        return
+    try:
+        await ImageEmbedding.objects.abulk_create(
+            [
+                ImageEmbedding(
+                    content_hash=content_hash, embedding=embedding_to_bytes(embedding)
+                )
+                for content_hash, embedding in embeddings.items()
+            ],
+            ignore_conflicts=True,
+        )
+    except IntegrityError as e:
+        logger.info(f"Error storing cached embeddings: {str(e)}")
+    await _set_redis(get_redis_client(), embeddings)
+
+
+async def _set_redis(redis_client, embeddings):
+    if redis_client is None or not embeddings:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for content_hash, embedding in embeddings.items():
+                pipe.set(
+                    REDIS_KEY_PREFIX + content_hash,
+                    embedding_to_bytes(embedding),
+                    ex=settings.EMBEDDING_CACHE_REDIS_TTL,
+                )
+            await pipe.execute()
+    except Exception as e:
+        logger.info(f"Redis embedding cache unavailable: {str(e)}")
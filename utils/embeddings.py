@@ -0,0 +1,175 @@
+import asyncio
+import io
+import threading
+import weakref
+
+from django.conf import settings
+from PIL import Image
+
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+
+class ClipModelRegistry:
+    """
+    Loads the CLIP model on first use and shares it across the process.
+    torch and clip are imported lazily so processes that never embed
+    anything (web, admin, management commands) don't pay for them.
+    """
+
+    def __init__(self, model_name="ViT-B/32"):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def get(self):
+        loaded = self._loaded
+        if loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._loaded = self._load()
+                loaded = self._loaded
+        return loaded
+
+    def _load(self):
+        import clip
+        import torch
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Loading CLIP model {self.model_name} on {device}")
+        model, preprocess = clip.load(self.model_name, device=device)
+        return model, preprocess, device
+
+
+clip_models = ClipModelRegistry()
+
+
+def get_clip_model():
+    return clip_models.get()
+
+
+def warm_up_clip_model():
+    """Load the model and run one dummy forward pass so the first real analysis is warm."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (224, 224)).save(buffer, format="JPEG")
+    sync_compute_embeddings([buffer.getvalue()])
+    logger.info("CLIP model warmed up")
+
+
+def to_rgb_image(image):
+    # Raw bytes (decoded here, inside the batch), or an already decoded PIL image
+    if isinstance(image, Image.Image):
+        return image
+    return Image.open(io.BytesIO(image)).convert("RGB")
+
+
+def sync_compute_embeddings(images_content):
+    """
+    Embed a list of images (raw bytes or decoded PIL images) with a single
+    CLIP forward pass. Returns a (len(images_content), 512) NumPy array.
+    """
+    import torch
+
+    model, preprocess, device = get_clip_model()
+    image_inputs = torch.stack(
+        [preprocess(to_rgb_image(content)) for content in images_content]
+    ).to(device)
+    with torch.no_grad():
+        embeddings = model.encode_image(image_inputs)
+    return embeddings.cpu().numpy()
+
+
+def sync_compute_embedding(image_content):
+    return sync_compute_embeddings([image_content])[0]
+
+
+def compute_embedding(image_path):
+    import torch
+
+    model, preprocess, device = get_clip_model()
+    image = Image.open(image_path).convert("RGB")
+    image_input = preprocess(image).unsqueeze(0).to(device)
+    with torch.no_grad():
+        embedding = model.encode_image(image_input)
+    embedding = embedding.cpu().numpy().flatten()
+    return embedding
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests made on one event loop and runs them through
+    CLIP together. A batch is flushed as soon as it holds `max_batch_size`
+    images, or `flush_timeout` seconds after its first request arrived.
+    """
+
+    def __init__(self, max_batch_size, flush_timeout):
+        self.max_batch_size = max_batch_size
+        self.flush_timeout = flush_timeout
+        self._pending = []
+        self._flush_handle = None
+
+    async def embed(self, image_content):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image_content, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_timeout, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        contents = [content for content, _ in batch]
+        logger.info(f"Computing CLIP embeddings for a batch of {len(contents)} images")
+
+        try:
+            embeddings = await loop.run_in_executor(
+                None, sync_compute_embeddings, contents
+            )
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # One bad image should not fail its neighbours, retry them one by one
+            logger.info(f"Batch embedding failed ({str(e)}), retrying per image")
+            for item in batch:
+                await self._run_batch([item])
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_embedding_batcher():
+    # One batcher per event loop, so concurrent analyses in the same worker share it
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = EmbeddingBatcher(
+            max_batch_size=settings.CLIP_EMBED_BATCH_SIZE,
+            flush_timeout=settings.CLIP_EMBED_FLUSH_TIMEOUT,
+        )
+        _batchers[loop] = batcher
+    return batcher
+
+
+async def compute_image_embedding(image_content):
+    return await get_embedding_batcher().embed(image_content)
@@ -0,0 +1,85 @@
+import math
+
+from django.conf import settings
+
+GRID_LAYOUTS = {"2x2": 2, "3x3": 3, "4x4": 4}
+ADAPTIVE_LAYOUT = "adaptive"
+
+
+def grid_side(layout, image_count):
+    """
+    Cells per row and column for `layout`. "adaptive" picks the smallest grid
+    that fits image_count photos in at most GRID_ADAPTIVE_TARGET_CALLS calls,
+    up to 4x4.
+    """
+    if layout in GRID_LAYOUTS:
+        return GRID_LAYOUTS[layout]
+    if layout != ADAPTIVE_LAYOUT:
+        raise ValueError(f"Unknown grid layout: {layout}")
+    for side in sorted(GRID_LAYOUTS.values()):
+        if math.ceil(image_count / side**2) <= settings.GRID_ADAPTIVE_TARGET_CALLS:
+            return side
+    return max(GRID_LAYOUTS.values())
+
+
+def chunk_for_grid(items, layout):
+    """(side, chunks) with every chunk filling at most one side x side grid."""
+    side = grid_side(layout, len(items))
+    cells = side * side
+    return side, [items[i : i + cells] for i in range(0, len(items), cells)]
+
+
+def grid_description(side, image_count):
+    """Tells the model how the photos of a grid are numbered, for grids other than 2x2."""
+    if side == 2:
+        # The established prompts already describe the 2x2 grid
+        return ""
+    return (
+        f"\n\nThe image is a {side}x{side} grid of {image_count} photos, numbered 1 "
+        f"to {image_count} from left to right and top to bottom. Return one result "
+        f"per photo, in that order."
+    )
+
+
+def new_grid_stats(layout):
+    return {
+        "layout": layout,
+        "calls": 0,
+        "images": 0,
+        "covered_images": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost": 0.0,
+        "cache_hits": 0,
+        "grid_sizes": {},
+    }
+
+
+def record_grid_call(stats, side, image_count, covered_images, structured_output):
+    """Add one vision call to stats. covered_images is how many photos got a usable result."""
+    structured_output = structured_output or {}
+    stats["calls"] += 1
+    stats["images"] += image_count
+    stats["covered_images"] += covered_images
+    stats["prompt_tokens"] += structured_output.get("prompt_tokens", 0)
+    stats["completion_tokens"] += structured_output.get("completion_tokens", 0)
+    stats["cost"] += structured_output.get("prompt_tokens_cost", 0) + (
+        structured_output.get("completion_tokens_cost", 0)
+    )
+    if structured_output.get("cache_hit"):
+        stats["cache_hits"] += 1
+    grid_size = f"{side}x{side}"
+    stats["grid_sizes"][grid_size] = stats["grid_sizes"].get(grid_size, 0) + 1
+
+
+def summarize_grid_stats(stats):
+    stats["coverage"] = (
+        round(stats["covered_images"] / stats["images"], 4) if stats["images"] else None
+    )
+    stats["tokens_per_image"] = (
+        round((stats["prompt_tokens"] + stats["completion_tokens"]) / stats["images"], 1)
+        if stats["images"]
+        else None
+    )
+    stats["cost"] = round(stats["cost"], 6)
+    return stats
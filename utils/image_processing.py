@@ -1,18 +1,20 @@
 import asyncio
 import base64
 import io
+import math
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 import aiohttp
-import clip
 import cv2
 import numpy as np
 import pandas as pd
 import requests
-import torch
 from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.utils import timezone
 from PIL import Image
@@ -27,36 +29,17 @@ from selenium.webdriver.support.ui import WebDriverWait
 
 from analysis.models import PropertyImage
 from property_analysis.config.logging_config import configure_logger
+from utils.embedding_cache import (
+    compute_content_hash,
+    get_cached_embeddings,
+    store_embeddings,
+)
+from utils.embeddings import compute_image_embedding
 
 logger = configure_logger(__name__)
 
-
-# Initialize CLIP model and preprocessing
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-
-
-async def compute_image_embedding(image_content):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, sync_compute_embedding, image_content)
-
-
-def sync_compute_embedding(image_content):
-    image = Image.open(io.BytesIO(image_content)).convert("RGB")
-    image_input = preprocess(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        embedding = model.encode_image(image_input)
-    embedding = embedding.cpu().numpy().flatten()
-    return embedding
-
-
-def compute_embedding(image_path):
-    image = Image.open(image_path).convert("RGB")
-    image_input = preprocess(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        embedding = model.encode_image(image_input)
-    embedding = embedding.cpu().numpy().flatten()
-    return embedding
+# Size of one cell of the image grids sent to GPT-4o
+TILE_SIZE = (256, 256)
 
 
 # Define headers to mimic a real browser request
@@ -152,11 +135,49 @@ def get_image_urls(property_url):
     return selected_images
 
 
+async def prune_property_images(property_instance):
+    """
+    Delete the images of a previous analysis that are no longer in the listing.
+    Returns the kept PropertyImage objects keyed by their original URL.
+    """
+    listed_urls = set(property_instance.image_urls or [])
+    kept_images = {}
+    removed_ids = []
+    async for property_image in PropertyImage.objects.filter(
+        property=property_instance
+    ).order_by("id"):
+        if property_image.original_url in listed_urls and (
+            property_image.original_url not in kept_images
+        ):
+            kept_images[property_image.original_url] = property_image
+        else:
+            removed_ids.append(property_image.id)
+
+    if removed_ids:
+        await PropertyImage.objects.filter(id__in=removed_ids).adelete()
+    logger.info(
+        f"Keeping {len(kept_images)} previously analysed images, removed {len(removed_ids)}"
+    )
+    return kept_images
+
+
 async def download_images(
-    property_instance, update_progress, max_retries=3, retry_delay=1, use_selenium=False
+    property_instance,
+    update_progress,
+    max_retries=3,
+    retry_delay=1,
+    use_selenium=False,
+    skip_urls=(),
+    working_set=None,
 ):
-    image_ids = []
+    image_urls = property_instance.image_urls
+    skip_urls = set(skip_urls)
+    total_images = sum(1 for image_url in image_urls if image_url not in skip_urls)
+    # Indexed by position in the listing, skipped URLs leave their slot empty
+    downloaded_ids = [None] * len(image_urls)
     failed_downloads = []
+    downloaded_contents = []
+    completed = 0
     driver = None
 
     if use_selenium:
@@ -167,71 +188,159 @@ async def download_images(
         chrome_options.add_argument("--disable-dev-shm-usage")
         driver = webdriver.Chrome(options=chrome_options)
 
-    try:
-        for idx, image_url in enumerate(property_instance.image_urls):
+    # The selenium driver can only load one page at a time
+    selenium_lock = asyncio.Lock()
+    semaphore = asyncio.Semaphore(settings.IMAGE_DOWNLOAD_CONCURRENCY)
+
+    async def download_one(session, idx, image_url):
+        nonlocal completed
+        async with semaphore:
             for attempt in range(max_retries):
+                property_image = None
                 try:
                     if use_selenium:
-                        img_content = await sync_to_async(download_with_selenium)(
-                            driver, image_url
-                        )
+                        async with selenium_lock:
+                            img_content = await sync_to_async(download_with_selenium)(
+                                driver, image_url
+                            )
                     else:
-                        img_content = await download_with_requests(image_url)
-
-                    if img_content:
-                        # print(f"Image content downloaded, length: {len(img_content)}")
-
-                        # Generate a filename
-                        file_name = f"property_{property_instance.id}_image_{idx}.jpg"
-
-                        property_image = await PropertyImage.objects.acreate(
-                            property=property_instance,
-                            original_url=image_url,
-                            created_at=timezone.now(),
-                        )
-
-                        # Save the image content
-                        await sync_to_async(property_image.image.save)(
-                            file_name, ContentFile(img_content), save=False
-                        )
-
-                        # Compute and store embedding and save the PropertyImage instance
-                        embedding = await compute_image_embedding(img_content)
-                        property_image.embedding = embedding.tolist()
-                        await property_image.asave()
-
-                        logger.info(
-                            f"PropertyImage object created with ID: {property_image.id}"
-                        )
-
-                        # # Verify file was saved
-                        # if property_image.image:
-                        #     # logger.info(f"Image file saved at: {property_image.image.path}")
-                        #     logger.info(f"File exists: {await sync_to_async(os.path.exists)(property_image.image.path)}")
-                        # else:
-                        #     logger.info("Image file was not saved properly")
-
-                        image_ids.append(property_image.id)
-                        await update_progress(
-                            "download",
-                            f"Downloaded image {idx + 1}",
-                            (idx + 1) / len(property_instance.image_urls) * 100,
+                        img_content = await download_with_requests(image_url, session)
+
+                    if not img_content:
+                        raise ValueError("No image content downloaded")
+
+                    # Decoded once for the working set tile and the stored tile.
+                    # The full-resolution copy is dropped straight away.
+                    (
+                        decoded_image,
+                        tile,
+                        tile_content,
+                    ) = await asyncio.get_running_loop().run_in_executor(
+                        get_composite_executor(), decode_with_tile, img_content
+                    )
+                    # Content that isn't an image would break grid compositing
+                    # later, retry it and report it as a failed download
+                    if decoded_image is None:
+                        raise ValueError("Downloaded content is not a valid image")
+                    del decoded_image
+
+                    # Generate a filename
+                    file_name = f"property_{property_instance.id}_image_{idx}.jpg"
+
+                    property_image = await PropertyImage.objects.acreate(
+                        property=property_instance,
+                        original_url=image_url,
+                        content_hash=compute_content_hash(img_content),
+                        created_at=timezone.now(),
+                    )
+
+                    # Save the image content
+                    await sync_to_async(property_image.image.save)(
+                        file_name, ContentFile(img_content), save=False
+                    )
+
+                    if tile_content is not None:
+                        await sync_to_async(property_image.thumbnail.save)(
+                            f"property_{property_instance.id}_tile_{idx}.jpg",
+                            ContentFile(tile_content),
+                            save=False,
                         )
-                        break  # Successful download, move to next image
+                    await property_image.asave()
+                    break  # Successful download, move to next image
                 except Exception as e:
                     logger.info(f"Error downloading image {idx}: {str(e)}")
+                    if property_image is not None and property_image.pk:
+                        # Don't leave a half-saved row behind for the retry to duplicate
+                        for field in (property_image.image, property_image.thumbnail):
+                            if field:
+                                await sync_to_async(field.delete)(save=False)
+                        await property_image.adelete()
                     if attempt == max_retries - 1:
                         failed_downloads.append((idx, image_url, str(e)))
-                    else:
-                        await asyncio.sleep(retry_delay * (attempt + 1))
+                        return
+                    await asyncio.sleep(retry_delay * (attempt + 1))
+            else:
+                return  # max_retries == 0
+
+        # Only recorded once the row and its files are saved, a failed attempt
+        # above leaves nothing behind to embed, return or count
+        logger.info(f"PropertyImage object created with ID: {property_image.id}")
+        if tile is not None and working_set is not None:
+            working_set.add_tile(property_image.id, tile)
+        # Embeddings are computed in batches once all images are downloaded.
+        # Only the compressed bytes are kept until then, and CLIP decodes them
+        # when their batch runs.
+        downloaded_contents.append((property_image, img_content))
+        downloaded_ids[idx] = property_image.id
+        completed += 1
+        await update_progress(
+            "download",
+            f"Downloaded image {completed}",
+            completed / total_images * 100,
+        )
+
+    # One keep-alive connection pool for the whole listing, most photos share a CDN host
+    connector = aiohttp.TCPConnector(
+        limit=settings.IMAGE_DOWNLOAD_CONCURRENCY,
+        limit_per_host=settings.IMAGE_DOWNLOAD_PER_HOST_LIMIT,
+    )
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(
+                *(
+                    download_one(session, idx, image_url)
+                    for idx, image_url in enumerate(image_urls)
+                    if image_url not in skip_urls
+                )
+            )
         logger.info("Finished processing all images")
+
+        await store_image_embeddings(downloaded_contents)
     finally:
         if driver:
             await sync_to_async(driver.quit)()
 
+    image_ids = [image_id for image_id in downloaded_ids if image_id is not None]
+    failed_downloads.sort(key=lambda failed: failed[0])
     return image_ids, failed_downloads
 
 
+async def store_image_embeddings(downloaded_contents):
+    # Photos seen before (re-analyses, agents reusing photos) are looked up by content hash
+    embeddings = await get_cached_embeddings(
+        [property_image.content_hash for property_image, _ in downloaded_contents]
+    )
+
+    # Identical photos within a listing only need to be embedded once
+    to_embed = {}
+    for property_image, content in downloaded_contents:
+        if property_image.content_hash not in embeddings:
+            to_embed.setdefault(property_image.content_hash, content)
+
+    # Queue every image at once so the embedding batcher can fill whole batches
+    computed = await asyncio.gather(
+        *(compute_image_embedding(content) for content in to_embed.values()),
+        return_exceptions=True,
+    )
+    new_embeddings = {}
+    for content_hash, embedding in zip(to_embed, computed):
+        if isinstance(embedding, Exception):
+            logger.info(
+                f"Error computing embedding for image {content_hash}: {str(embedding)}"
+            )
+            continue
+        new_embeddings[content_hash] = embedding
+    await store_embeddings(new_embeddings)
+    embeddings.update(new_embeddings)
+
+    for property_image, _ in downloaded_contents:
+        embedding = embeddings.get(property_image.content_hash)
+        if embedding is None:
+            continue
+        property_image.set_embedding(embedding)
+        await property_image.asave(update_fields=["embedding"])
+
+
 def download_with_selenium(driver, image_url):
     try:
         driver.get(image_url)
@@ -262,18 +371,46 @@ def download_with_selenium(driver, image_url):
         return None
 
 
-async def download_with_requests(image_url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url, timeout=30) as response:
-            if response.status == 200:
-                return await response.read()
+async def download_with_requests(image_url, session=None):
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await download_with_requests(image_url, session)
+
+    async with session.get(image_url, timeout=30) as response:
+        if response.status == 200:
+            return await response.read()
     return None
 
 
+def decode_image(image_content):
+    """Decode downloaded bytes to an RGB PIL image, or None if they are not an image."""
+    try:
+        return Image.open(io.BytesIO(image_content)).convert("RGB")
+    except Exception as e:
+        logger.info(f"Could not decode downloaded image: {str(e)}")
+        return None
+
+
+def decode_with_tile(image_content):
+    """
+    The decoded image, its letterboxed grid tile and the tile as JPEG bytes,
+    or (None, None, None) if the content is not an image.
+    """
+    decoded_image = decode_image(image_content)
+    if decoded_image is None:
+        return None, None, None
+    tile = letterbox(decoded_image, TILE_SIZE)
+    tile_byte_arr = io.BytesIO()
+    tile.save(tile_byte_arr, format="JPEG", quality=90)
+    return decoded_image, tile, tile_byte_arr.getvalue()
+
+
 def resize_with_aspect_ratio(image, target_size):
-    img = Image.open(image)
-    img = img.convert("RGB")
-    img_array = np.array(img)
+    return letterbox(Image.open(image), target_size)
+
+
+def letterbox(img, target_size):
+    img_array = np.array(img.convert("RGB"))
     h, w = img_array.shape[:2]
     scale = min(target_size[0] / h, target_size[1] / w)
     new_h, new_w = int(h * scale), int(w * scale)
@@ -291,43 +428,100 @@ def resize_with_aspect_ratio(image, target_size):
     return Image.fromarray(padded_image)
 
 
-async def merge_images(image_objects, condition=None):
-    target_size = (256, 256)
-    resized_images = [
-        resize_with_aspect_ratio(img.image, target_size) for img in image_objects
-    ]
+_composite_executor = None
+_composite_executor_lock = threading.Lock()
+
+
+def get_composite_executor():
+    # Shared by every event loop in the process, the pool is not tied to one
+    global _composite_executor
+    if _composite_executor is None:
+        with _composite_executor_lock:
+            if _composite_executor is None:
+                _composite_executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_COMPOSITE_WORKERS,
+                    thread_name_prefix="image-composite",
+                )
+    return _composite_executor
+
+
+async def merge_images(image_objects, condition=None, working_set=None, grid_size=2):
+    # Storage reads, decoding, resizing and JPEG encoding all run on the
+    # compositing pool so downloads and API calls keep going meanwhile
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_composite_executor(),
+        sync_merge_images,
+        image_objects,
+        condition,
+        working_set,
+        grid_size,
+    )
+
+
+def sync_merge_images(image_objects, condition=None, working_set=None, grid_size=2):
+    """
+    Composite up to grid_size x grid_size images into one JPEG, numbered 1..n
+    from left to right and top to bottom.
+    """
+    target_size = TILE_SIZE
+    tile_h, tile_w = target_size
+    resized_images = []
+    for img in image_objects[: grid_size * grid_size]:
+        # Tiles decoded at download time, then the stored tile, then the original
+        tile = working_set.get_tile(img.id) if working_set is not None else None
+        if tile is None:
+            thumbnail = getattr(img, "thumbnail", None)
+            tile = resize_with_aspect_ratio(thumbnail or img.image, target_size)
+        resized_images.append(tile)
     num_images = len(resized_images)
 
     if num_images == 1:
         merged_image = np.array(resized_images[0])
+        cols = 1
     elif num_images == 2:
-        merged_image = np.zeros((256, 512, 3), dtype=np.uint8)
-        merged_image[:, :256] = np.array(resized_images[0])
-        merged_image[:, 256:] = np.array(resized_images[1])
-        cv2.line(merged_image, (256, 0), (256, 256), (0, 0, 255), 2)
+        merged_image = np.zeros((tile_h, 2 * tile_w, 3), dtype=np.uint8)
+        merged_image[:, :tile_w] = np.array(resized_images[0])
+        merged_image[:, tile_w:] = np.array(resized_images[1])
+        cv2.line(merged_image, (tile_w, 0), (tile_w, tile_h), (0, 0, 255), 2)
+        cols = 2
     else:
-        merged_image = np.zeros((512, 512, 3), dtype=np.uint8)
-        positions = [(0, 0), (0, 256), (256, 0), (256, 256)]
-        for i, image in enumerate(resized_images[:4]):
-            y, x = positions[i]
-            merged_image[y : y + 256, x : x + 256] = np.array(image)[
+        # A 2x2 grid is always square, larger grids drop their empty rows
+        cols = grid_size
+        rows = grid_size if grid_size == 2 else math.ceil(num_images / cols)
+        merged_image = np.zeros((rows * tile_h, cols * tile_w, 3), dtype=np.uint8)
+        for i, image in enumerate(resized_images):
+            y, x = (i // cols) * tile_h, (i % cols) * tile_w
+            merged_image[y : y + tile_h, x : x + tile_w] = np.array(image)[
                 :, :, :3
             ]  # Ensure we only take RGB channels
-        cv2.line(merged_image, (256, 0), (256, 512), (0, 0, 255), 2)
-        cv2.line(merged_image, (0, 256), (512, 256), (0, 0, 255), 2)
+        for col in range(1, cols):
+            cv2.line(
+                merged_image,
+                (col * tile_w, 0),
+                (col * tile_w, rows * tile_h),
+                (0, 0, 255),
+                2,
+            )
+        for row in range(1, rows):
+            cv2.line(
+                merged_image,
+                (0, row * tile_h),
+                (cols * tile_w, row * tile_h),
+                (0, 0, 255),
+                2,
+            )
 
     font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 1
     font_color = (255, 255, 255)
     thickness = 2
 
-    label_positions = [(10, 30), (266, 30), (10, 286), (266, 286)]
-
-    for i in range(min(num_images, 4)):
+    for i in range(num_images):
         cv2.putText(
             merged_image,
             str(i + 1),
-            label_positions[i],
+            ((i % cols) * tile_w + 10, (i // cols) * tile_h + 30),
             font,
             font_scale,
             font_color,
@@ -0,0 +1,172 @@
+import hashlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from analysis.models import ListingResult, PropertyImage
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+# Scraped listing fields copied when a result is reused without scraping again
+LISTING_FIELDS = [
+    "address",
+    "price",
+    "bedrooms",
+    "bathrooms",
+    "size",
+    "house_type",
+    "agent",
+    "description",
+    "listing_type",
+    "time_on_market",
+    "features",
+    "image_urls",
+    "floorplan_urls",
+    "failed_downloads",
+]
+
+
+def compute_listing_fingerprint(image_urls, description):
+    """SHA-256 over the set of image URLs and the description of a scraped listing."""
+    hasher = hashlib.sha256()
+    for image_url in sorted(set(image_urls or [])):
+        hasher.update(image_url.encode("utf-8"))
+        hasher.update(b"\n")
+    hasher.update(hashlib.sha256((description or "").encode("utf-8")).digest())
+    return hasher.hexdigest()
+
+
+def find_listing_result(url, fingerprint=None, max_age=None):
+    """Most recent stored result for the listing, optionally matching a fingerprint."""
+    listing_results = ListingResult.objects.filter(url=url).select_related(
+        "source_property"
+    )
+    if fingerprint is not None:
+        listing_results = listing_results.filter(fingerprint=fingerprint)
+    if max_age is not None:
+        listing_results = listing_results.filter(
+            updated_at__gte=timezone.now() - timedelta(seconds=max_age)
+        )
+    return listing_results.order_by("-updated_at").first()
+
+
+def is_complete_analysis(result, failed_downloads=()):
+    """
+    Whether an analysis result may be stored for reuse. Partial results
+    (failed downloads, categorisation batches or labelled groups, or no
+    overall condition) would otherwise be served to other users for up to
+    LISTING_RESULT_MAX_AGE without ever being re-analysed.
+    """
+    if failed_downloads:
+        return False
+    condition = result.get("Condition")
+    # analyze_property_condition returns "Insufficient data" without scores
+    if not isinstance(condition, dict) or "error" in condition:
+        return False
+    image_analysis = (result.get("Overall Analysis") or {}).get("Image_Analysis", {})
+    return not (
+        image_analysis.get("categorization", {}).get("failed_batches")
+        or image_analysis.get("labelling", {}).get("failed_groups")
+    )
+
+
+def store_listing_result(property_instance, fingerprint):
+    listing_result, _ = ListingResult.objects.update_or_create(
+        url=property_instance.url,
+        fingerprint=fingerprint,
+        defaults={
+            "source_property": property_instance,
+            "overall_condition": property_instance.overall_condition,
+            "detailed_analysis": property_instance.detailed_analysis,
+            "overall_analysis": property_instance.overall_analysis,
+        },
+    )
+    return listing_result
+
+
+def remap_detailed_analysis(detailed_analysis, images_by_source_id):
+    """
+    Copy of a detailed analysis ({group: [image analysis]}) whose image_id
+    and image_url point at the cloned PropertyImages instead of the source's.
+    """
+    if not isinstance(detailed_analysis, dict):
+        return detailed_analysis
+    remapped = {}
+    for key, analyses in detailed_analysis.items():
+        remapped[key] = []
+        for analysis in analyses:
+            analysis = dict(analysis)
+            image = images_by_source_id.get(analysis.get("image_id"))
+            if image is not None:
+                analysis["image_id"] = image.id
+                analysis["image_url"] = image.image.url if image.image else None
+            remapped[key].append(analysis)
+    return remapped
+
+
+def clone_listing_result(listing_result, property_instance, copy_listing_fields=True):
+    """
+    Copy a finished analysis onto property_instance: the analysis results,
+    the reviewed description and the analysed PropertyImage rows (which keep
+    pointing at the same stored files). With copy_listing_fields the scraped
+    listing data is copied too, for when the listing was not scraped again.
+    """
+    source = listing_result.source_property
+
+    with transaction.atomic():
+        PropertyImage.objects.filter(property=property_instance).delete()
+        source_ids = []
+        cloned_images = []
+        for image in PropertyImage.objects.filter(property=source).order_by("id"):
+            source_ids.append(image.id)
+            image.pk = None
+            image.property = property_instance
+            cloned_images.append(image)
+        PropertyImage.objects.bulk_create(cloned_images)
+        images_by_source_id = dict(zip(source_ids, cloned_images))
+
+        # The stored results reference images by id, point them at the clones
+        detailed_analysis = remap_detailed_analysis(
+            listing_result.detailed_analysis, images_by_source_id
+        )
+        overall_analysis = listing_result.overall_analysis
+        if isinstance(overall_analysis, dict) and isinstance(
+            overall_analysis.get("stages"), dict
+        ):
+            overall_analysis = {
+                **overall_analysis,
+                "stages": {
+                    **overall_analysis["stages"],
+                    "detailed_analysis": remap_detailed_analysis(
+                        overall_analysis["stages"].get("detailed_analysis"),
+                        images_by_source_id,
+                    ),
+                },
+            }
+
+        if copy_listing_fields:
+            for field in LISTING_FIELDS:
+                setattr(property_instance, field, getattr(source, field))
+        property_instance.reviewed_description = source.reviewed_description
+        property_instance.overall_condition = listing_result.overall_condition
+        property_instance.detailed_analysis = detailed_analysis
+        property_instance.overall_analysis = overall_analysis
+        property_instance.save()
+
+    logger.info(
+        f"Reused analysis of property {source.id} for property {property_instance.id}"
+    )
+
+
+def listing_result_summary(listing_result):
+    # Same shape as the final result returned by process_property
+    overall_analysis = listing_result.overall_analysis or {}
+    return {
+        "Property URL": listing_result.url,
+        "Condition": listing_result.overall_condition,
+        "Detailed Analysis": listing_result.detailed_analysis,
+        "Overall Analysis": overall_analysis,
+        "Analysis Stages": overall_analysis.get("stages", {}),
+    }
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from analysis.models import LLMResponse
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+
+def _digest(value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of vision responses. Entries expire after LLM_CACHE_TTL
+    seconds and the table is trimmed to the LLM_CACHE_MAX_ENTRIES most
+    recently used rows, once every LLM_CACHE_EVICT_EVERY writes of this
+    process rather than on every write. Hit/miss counters are kept per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    @staticmethod
+    def make_key(model, text_prompt, images):
+        parts = [model, _digest(text_prompt)] + [_digest(image) for image in images]
+        return _digest("\n".join(parts))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, cache_key):
+        if not settings.LLM_CACHE_ENABLED:
+            return None
+
+        cached = LLMResponse.objects.filter(cache_key=cache_key).first()
+        expires_before = timezone.now() - timedelta(seconds=settings.LLM_CACHE_TTL)
+        if cached is None or cached.created_at < expires_before:
+            if cached is not None:
+                cached.delete()
+            self._count(hit=False)
+            return None
+
+        LLMResponse.objects.filter(pk=cached.pk).update(
+            hit_count=F("hit_count") + 1, last_used_at=timezone.now()
+        )
+        self._count(hit=True)
+        logger.info(f"LLM cache hit for {cached.model} ({self.stats()})")
+        return {
+            "response_content": cached.response_content,
+            "prompt_tokens": cached.prompt_tokens,
+            "prompt_tokens_cost": 0,
+            "completion_tokens": cached.completion_tokens,
+            "completion_tokens_cost": 0,
+            "cache_hit": True,
+        }
+
+    def set(self, cache_key, model, structured_output):
+        if not settings.LLM_CACHE_ENABLED:
+            return
+        if "error" in structured_output or not structured_output.get(
+            "response_content"
+        ):
+            return
+
+        LLMResponse.objects.update_or_create(
+            cache_key=cache_key,
+            defaults={
+                "model": model,
+                "response_content": structured_output["response_content"],
+                "prompt_tokens": structured_output.get("prompt_tokens", 0),
+                "completion_tokens": structured_output.get("completion_tokens", 0),
+                "last_used_at": timezone.now(),
+            },
+        )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % settings.LLM_CACHE_EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        expires_before = timezone.now() - timedelta(seconds=settings.LLM_CACHE_TTL)
+        LLMResponse.objects.filter(created_at__lt=expires_before).delete()
+
+        # Keep only the most recently used entries: one indexed lookup of the
+        # oldest last_used_at to keep, then a range delete below it
+        cutoff = (
+            LLMResponse.objects.order_by("-last_used_at")
+            .values_list("last_used_at", flat=True)[
+                settings.LLM_CACHE_MAX_ENTRIES - 1 : settings.LLM_CACHE_MAX_ENTRIES
+            ]
+            .first()
+        )
+        if cutoff is not None:
+            LLMResponse.objects.filter(last_used_at__lt=cutoff).delete()
+
+    async def aget(self, cache_key):
+        return await sync_to_async(self.get)(cache_key)
+
+    async def aset(self, cache_key, model, structured_output):
+        await sync_to_async(self.set)(cache_key, model, structured_output)
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,137 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Q, Sum
+
+from analysis.models import LLMCall
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o": (5, 15),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+
+# The analysis task and pipeline stage LLM calls are attributed to. Set once
+# per task and stage, so the OpenAI helpers don't need them as arguments.
+current_task_id = contextvars.ContextVar("llm_metering_task_id", default=None)
+current_stage = contextvars.ContextVar("llm_metering_stage", default="")
+
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    """(prompt cost, completion cost) in USD, zero for models without a price."""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (
+        prompt_tokens * prompt_price / 1000000,
+        completion_tokens * completion_price / 1000000,
+    )
+
+
+@contextmanager
+def metered_task(task_id):
+    """Attribute the LLM calls made inside the block to the AnalysisTask task_id."""
+    token = current_task_id.set(task_id)
+    try:
+        yield
+    finally:
+        current_task_id.reset(token)
+
+
+@contextmanager
+def llm_stage(stage):
+    # Tasks started inside the block (asyncio.gather) copy the stage with the context
+    token = current_stage.set(stage)
+    try:
+        yield
+    finally:
+        current_stage.reset(token)
+
+
+def build_llm_call(model, latency, structured_output=None, cache_hit=False, success=True):
+    structured_output = structured_output or {}
+    prompt_tokens = structured_output.get("prompt_tokens", 0)
+    completion_tokens = structured_output.get("completion_tokens", 0)
+    if cache_hit:
+        cost = 0.0
+    elif "prompt_tokens_cost" in structured_output:
+        cost = structured_output["prompt_tokens_cost"] + structured_output.get(
+            "completion_tokens_cost", 0
+        )
+    else:
+        cost = sum(token_cost(model, prompt_tokens, completion_tokens))
+    return LLMCall(
+        task_id=current_task_id.get(),
+        stage=current_stage.get(),
+        model=model,
+        latency_ms=round(latency * 1000, 1),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost=cost,
+        cache_hit=cache_hit,
+        success=success,
+    )
+
+
+def record_llm_call(model, latency, structured_output=None, cache_hit=False, success=True):
+    """Store one LLM call. Metering never fails the call it measures."""
+    if not settings.LLM_METERING_ENABLED:
+        return
+    try:
+        build_llm_call(model, latency, structured_output, cache_hit, success).save()
+    except Exception as e:
+        logger.error(f"Failed to record LLM call: {e}")
+
+
+async def arecord_llm_call(
+    model, latency, structured_output=None, cache_hit=False, success=True
+):
+    if not settings.LLM_METERING_ENABLED:
+        return
+    try:
+        await build_llm_call(
+            model, latency, structured_output, cache_hit, success
+        ).asave()
+    except Exception as e:
+        logger.error(f"Failed to record LLM call: {e}")
+
+
+def summarize_llm_calls(task):
+    """Calls, tokens, cost and latency of an analysis task, in total and per stage."""
+    aggregates = {
+        "calls": Count("id"),
+        "cache_hits": Count("id", filter=Q(cache_hit=True)),
+        "failures": Count("id", filter=Q(success=False)),
+        "prompt_tokens": Sum("prompt_tokens"),
+        "completion_tokens": Sum("completion_tokens"),
+        "cost": Sum("cost"),
+        "avg_latency_ms": Avg("latency_ms"),
+        "max_latency_ms": Max("latency_ms"),
+    }
+    calls = LLMCall.objects.filter(task=task)
+
+    def clean(row):
+        for field in ("prompt_tokens", "completion_tokens"):
+            row[field] = row[field] or 0
+        row["cost"] = round(row["cost"] or 0, 6)
+        for field in ("avg_latency_ms", "max_latency_ms"):
+            row[field] = round(row[field], 1) if row[field] is not None else None
+        return row
+
+    stages = {}
+    for row in calls.values("stage").annotate(**aggregates).order_by("stage"):
+        stages[row.pop("stage") or "other"] = clean(row)
+
+    models = {}
+    for row in calls.values("model").annotate(**aggregates).order_by("model"):
+        models[row.pop("model")] = clean(row)
+
+    return {
+        "task_id": task.id,
+        "status": task.status,
+        "total": clean(calls.aggregate(**aggregates)),
+        "stages": stages,
+        "models": models,
+    }
@@ -3,157 +3,210 @@ import json
 import os
 import time
 
+from asgiref.sync import sync_to_async
+from openai import RateLimitError
+
+from property_analysis.config.base_config import get_async_openai_client
 from property_analysis.config.base_config import openai_client as client
 from property_analysis.config.logging_config import configure_logger
+from utils.llm_cache import llm_cache
+from utils.metering import arecord_llm_call, record_llm_call, token_cost
+from utils.taxonomy import TaxonomyLearner
 
 logger = configure_logger(__name__)
 
+VISION_MODEL = "gpt-4o"
+CHAT_MODEL = "gpt-4o-mini"
+
 
 def encode_image(image_file):
     with image_file.open("rb") as file:
         return base64.b64encode(file.read()).decode("utf-8")
 
 
-def analyze_single_image(text_prompt, target_image, sample_images_dict=None):
-    try:
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": text_prompt,
+def build_image_messages(text_prompt, target_image, sample_images_dict=None):
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": text_prompt,
+                },
+            ],
+        }
+    ]
+
+    if sample_images_dict:
+        for condition, image_base64 in sample_images_dict.items():
+            messages[0]["content"].append(
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_base64,
+                        "detail": "low",
                     },
-                ],
-            }
-        ]
-
-        if sample_images_dict:
-            for condition, image_base64 in sample_images_dict.items():
-                messages[0]["content"].append(
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_base64,
-                            "detail": "low",
-                        },
-                    }
-                )
-
-        if not target_image.startswith("data:image/jpeg;base64,"):
-            raise ValueError("Target image must be a base64-encoded JPEG string")
-
-        if isinstance(target_image, str):
-            if target_image.startswith("data:image/jpeg;base64,"):
-                messages[0]["content"].append(
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": target_image,
-                            "detail": "low",
-                        },
-                    }
-                )
-            elif os.path.isfile(target_image):
-                base64_image = encode_image(target_image)
-                messages[0]["content"].append(
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                            "detail": "low",
-                        },
-                    }
-                )
-            elif target_image.startswith("http"):
-                messages[0]["content"].append(
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": target_image, "detail": "high"},
+                }
+            )
+
+    if not target_image.startswith("data:image/jpeg;base64,"):
+        raise ValueError("Target image must be a base64-encoded JPEG string")
+
+    if isinstance(target_image, str):
+        if target_image.startswith("data:image/jpeg;base64,"):
+            messages[0]["content"].append(
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": target_image,
+                        "detail": "low",
+                    },
+                }
+            )
+        elif os.path.isfile(target_image):
+            base64_image = encode_image(target_image)
+            messages[0]["content"].append(
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "detail": "low",
                     },
-                )
-            else:
-                print(f"Error: Unrecognized image format for {target_image}")
-                return None
+                }
+            )
+        elif target_image.startswith("http"):
+            messages[0]["content"].append(
+                {
+                    "type": "image_url",
+                    "image_url": {"url": target_image, "detail": "high"},
+                },
+            )
         else:
-            print(f"Error: target_image is not a string: {type(target_image)}")
+            print(f"Error: Unrecognized image format for {target_image}")
+            return None
+    else:
+        print(f"Error: target_image is not a string: {type(target_image)}")
+        return None
+
+    return messages
+
+
+def get_structured_output(response, model=VISION_MODEL):
+    prompt_tokens_cost, completion_tokens_cost = token_cost(
+        model, response.usage.prompt_tokens, response.usage.completion_tokens
+    )
+    return {
+        "response_content": response.choices[0].message.content,
+        "prompt_tokens": response.usage.prompt_tokens,
+        "prompt_tokens_cost": prompt_tokens_cost,
+        "completion_tokens": response.usage.completion_tokens,
+        "completion_tokens_cost": completion_tokens_cost,
+    }
+
+
+def get_image_cache_key(text_prompt, target_image, sample_images_dict=None):
+    images = list((sample_images_dict or {}).values()) + [target_image]
+    return llm_cache.make_key(VISION_MODEL, text_prompt, images)
+
+
+def analyze_single_image(text_prompt, target_image, sample_images_dict=None):
+    start_time = time.monotonic()
+    try:
+        cache_key = get_image_cache_key(text_prompt, target_image, sample_images_dict)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            record_llm_call(
+                VISION_MODEL,
+                time.monotonic() - start_time,
+                cached_output,
+                cache_hit=True,
+            )
+            return cached_output
+
+        messages = build_image_messages(text_prompt, target_image, sample_images_dict)
+        if messages is None:
             return None
 
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=VISION_MODEL,
             messages=messages,
             response_format={"type": "json_object"},
         )
+        structured_output = get_structured_output(response)
+        record_llm_call(VISION_MODEL, time.monotonic() - start_time, structured_output)
+        llm_cache.set(cache_key, VISION_MODEL, structured_output)
+        return structured_output
 
-        structured_output = {
-            "response_content": response.choices[0].message.content,
-            "prompt_tokens": response.usage.prompt_tokens,
-            "prompt_tokens_cost": (response.usage.prompt_tokens * 5) / 1000000,
-            "completion_tokens": response.usage.completion_tokens,
-            "completion_tokens_cost": (response.usage.completion_tokens * 15) / 1000000,
-        }
+    except Exception as e:
+        print(f"Error in analyze_single_image: {str(e)}")
+        record_llm_call(VISION_MODEL, time.monotonic() - start_time, success=False)
+        return {"error": str(e)}
+
+
+async def analyze_single_image_async(
+    text_prompt, target_image, sample_images_dict=None
+):
+    """Same as analyze_single_image, but awaits the API call instead of blocking the loop."""
+    start_time = time.monotonic()
+    try:
+        cache_key = get_image_cache_key(text_prompt, target_image, sample_images_dict)
+        cached_output = await llm_cache.aget(cache_key)
+        if cached_output is not None:
+            await arecord_llm_call(
+                VISION_MODEL,
+                time.monotonic() - start_time,
+                cached_output,
+                cache_hit=True,
+            )
+            return cached_output
+
+        messages = build_image_messages(text_prompt, target_image, sample_images_dict)
+        if messages is None:
+            return None
 
+        response = await get_async_openai_client().chat.completions.create(
+            model=VISION_MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+        structured_output = get_structured_output(response)
+        await arecord_llm_call(
+            VISION_MODEL, time.monotonic() - start_time, structured_output
+        )
+        await llm_cache.aset(cache_key, VISION_MODEL, structured_output)
         return structured_output
 
+    except RateLimitError as e:
+        logger.error(f"Rate limited in analyze_single_image_async: {str(e)}")
+        await arecord_llm_call(
+            VISION_MODEL, time.monotonic() - start_time, success=False
+        )
+        return {"error": str(e), "rate_limited": True}
     except Exception as e:
-        print(f"Error in analyze_single_image: {str(e)}")
+        logger.error(f"Error in analyze_single_image_async: {str(e)}")
+        await arecord_llm_call(
+            VISION_MODEL, time.monotonic() - start_time, success=False
+        )
         return {"error": str(e)}
 
 
 # update the JSON file
 async def update_prompt_json_file(spaces, classifications):
-    for classification in classifications["images"]:
-        category = classification["category"]
-        details = classification["details"]
-
-        if category == "internal":
-            room_type = details.get("room_type")
-            if room_type and room_type not in sum(spaces.values(), []):
-                spaces["living_space"].append(room_type)
-            if "others" in details:
-                other_type = details["others"]
-                if other_type not in spaces["others"]:
-                    spaces["others"].append(other_type)
-
-        elif category == "external":
-            exterior_type = details.get("exterior_type")
-            if exterior_type and exterior_type not in sum(spaces.values(), []):
-                spaces["front_garden_space"].append(exterior_type)
-            if "others" in details:
-                other_type = details["others"]
-                if other_type not in spaces["others"]:
-                    spaces["others"].append(other_type)
-
-        elif category == "floor plan":
-            floor_type = details.get("floor_type")
-            if floor_type and floor_type not in spaces["others"]:
-                spaces["others"].append(floor_type)
-
-        elif category == "others":
-            other_type = details["others"]
-            if other_type not in spaces["others"]:
-                spaces["others"].append(other_type)
-
-    # Remove duplicates by converting lists to sets and back to lists
-    for key in spaces:
-        spaces[key] = list(set(spaces[key]))
-    # Write the updated JSON back to the file
-    with open("utils/data.json", "w") as file:
-        json.dump(spaces, file, indent=4)
+    # Kept for older callers. `spaces` is no longer mutated, new types are
+    # merged into data.json through the taxonomy learner instead
+    taxonomy_learner = TaxonomyLearner()
+    taxonomy_learner.learn(classifications)
+    await sync_to_async(taxonomy_learner.persist)()
 
 
-def get_openai_chat_response(instruction, message, prompt_format):
-    start_time = time.time()
-
-    messages = [
-        {"role": "system", "content": instruction},
-        {"role": "user", "content": message},
-    ]
-
-    structured_response = client.chat.completions.create(
-        model="gpt-4o-mini",  # "chatgpt-4o-latest",
-        messages=messages,
-        response_format={
+def build_chat_request(instruction, message, prompt_format):
+    return {
+        "model": CHAT_MODEL,  # "chatgpt-4o-latest",
+        "messages": [
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": message},
+        ],
+        "response_format": {
             "type": "json_schema",
             "json_schema": {
                 "name": "doc_response",
@@ -161,10 +214,46 @@ def get_openai_chat_response(instruction, message, prompt_format):
                 "schema": prompt_format,
             },
         },
+    }
+
+
+def get_openai_chat_response(instruction, message, prompt_format):
+    start_time = time.time()
+
+    try:
+        structured_response = client.chat.completions.create(
+            **build_chat_request(instruction, message, prompt_format)
+        )
+    except Exception:
+        record_llm_call(CHAT_MODEL, time.time() - start_time, success=False)
+        raise
+
+    response = json.loads(structured_response.choices[0].message.content)
+    total = time.time() - start_time
+    logger.info(f"Chat Response Time: {total}")
+    record_llm_call(
+        CHAT_MODEL, total, get_structured_output(structured_response, CHAT_MODEL)
     )
 
+    return response
+
+
+async def get_openai_chat_response_async(instruction, message, prompt_format):
+    start_time = time.time()
+
+    try:
+        structured_response = await get_async_openai_client().chat.completions.create(
+            **build_chat_request(instruction, message, prompt_format)
+        )
+    except Exception:
+        await arecord_llm_call(CHAT_MODEL, time.time() - start_time, success=False)
+        raise
+
     response = json.loads(structured_response.choices[0].message.content)
     total = time.time() - start_time
     logger.info(f"Chat Response Time: {total}")
+    await arecord_llm_call(
+        CHAT_MODEL, total, get_structured_output(structured_response, CHAT_MODEL)
+    )
 
     return response
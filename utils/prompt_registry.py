@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+
+from analysis.models import CacheVersion, Prompt
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+# Bumped whenever a prompt is created, edited or reverted
+PROMPTS_CACHE = "prompts"
+
+
+class PromptRegistry:
+    """
+    Active version of each prompt, cached per process in a small LRU. Every
+    PROMPT_CACHE_REVALIDATE_INTERVAL seconds at most, the registry compares
+    the PROMPTS_CACHE version counter and drops everything if a prompt
+    changed in any process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts = OrderedDict()
+        self._version = None
+        self._checked_at = None
+
+    def _revalidate(self):
+        now = time.monotonic()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < settings.PROMPT_CACHE_REVALIDATE_INTERVAL
+        ):
+            return
+        version = CacheVersion.get_version(PROMPTS_CACHE)
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.info(
+                        f"Prompts changed (v{self._version} -> v{version}), clearing cache"
+                    )
+                self._prompts.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get(self, name):
+        """The active Prompt with the highest version, or None."""
+        self._revalidate()
+        with self._lock:
+            if name in self._prompts:
+                self._prompts.move_to_end(name)
+                return self._prompts[name]
+
+        prompt = (
+            Prompt.objects.filter(name=name, is_active=True).order_by("-version").first()
+        )
+        with self._lock:
+            self._prompts[name] = prompt
+            while len(self._prompts) > settings.PROMPT_CACHE_MAX_ENTRIES:
+                self._prompts.popitem(last=False)
+        return prompt
+
+    def get_content(self, name):
+        prompt = self.get(name)
+        return prompt.content if prompt else ""
+
+    def invalidate(self):
+        """Call after saving or reverting a prompt, every process drops its cache."""
+        CacheVersion.bump(PROMPTS_CACHE)
+        with self._lock:
+            self._prompts.clear()
+            self._checked_at = None
+
+
+prompt_registry = PromptRegistry()
+
+
+@lru_cache(maxsize=256)
+def build_labelling_prompt(labelling_prompt, conditions, grid_size=2):
+    """The labelling prompt followed by the sample conditions and target grid it is sent with."""
+    grid = f"{grid_size}x{grid_size} grid"
+    if grid_size != 2:
+        grid += ", numbered from left to right and top to bottom"
+    return (
+        f"{labelling_prompt}\n\nSample images are provided for the following conditions: {', '.join(conditions)}. "
+        f"The target images ({grid}) follow these sample images."
+    )
@@ -1,50 +1,29 @@
-import json
-
-from analysis.models import Prompt
+from utils.prompt_registry import prompt_registry
+from utils.taxonomy import space_taxonomy
 
 # generally if an property has lifestyle images, it most likely is above average or excellent
 # make the categorization output more flexible and then map the term. For terms outside the scope of categorization words, use the model to map the OOS to categorizations. i.e, let AI handle edge cases and update the code
 
-# Read the JSON file
-with open("utils/data.json", "r") as file:
-    spaces = json.load(file)
-
-internal_types = ", ".join(
-    sum(
-        (
-            spaces[area]
-            for area in [
-                "living_space",
-                "kitchen_space",
-                "bathroom_space",
-                "bedroom_space",
-            ]
-        ),
-        [],
-    )
-)
-external_types = ", ".join(
-    sum((spaces[area] for area in ["front_garden_space", "back_garden_space"]), [])
-)
+INTERNAL_SPACE_KEYS = ["living_space", "kitchen_space", "bathroom_space", "bedroom_space"]
+EXTERNAL_SPACE_KEYS = ["front_garden_space", "back_garden_space"]
 
 
-def get_prompts():
-    labelling_prompt_obj = (
-        Prompt.objects.filter(name="labelling_prompt", is_active=True)
-        .order_by("-version")
-        .first()
+def get_space_types(space_keys):
+    spaces = space_taxonomy.spaces
+    return ", ".join(
+        space_type for space_key in space_keys for space_type in spaces[space_key]
     )
-    # categorize_prompt_obj = Prompt.objects.filter(name='categorize_prompt', is_active=True).order_by('-version').first()
-    # spaces_prompt_obj = Prompt.objects.filter(name='spaces', is_active=True).order_by('-version').first()
 
-    # categorize_prompt = categorize_prompt_obj.content if categorize_prompt_obj else ""
-    labelling_prompt = labelling_prompt_obj.content if labelling_prompt_obj else ""
-    # spaces = spaces_prompt_obj.spaces if spaces_prompt_obj and spaces_prompt_obj.spaces else []
+
+def get_prompts():
+    # Served from the per-process registry, which follows prompt edits
+    labelling_prompt = prompt_registry.get_content("labelling_prompt")
+    # categorize_prompt = prompt_registry.get_content("categorize_prompt")
 
     return labelling_prompt  # , spaces  # , categorize_prompt
 
 
-categorize_prompt = f"""
+CATEGORIZE_PROMPT_TEMPLATE = """
 You are an image classification assistant. Categorize each image as either "internal," "external," or "floor plan." Provide details based on the category:
 
 - For "internal": Specify the room type from the following list:
@@ -88,6 +67,39 @@ If processing multiple images, wrap the results in a "images" array:
 Ensure consistency in naming and use lowercase for all types.
 """
 
+# (taxonomy version, prompt) of the last categorisation prompt built
+_categorize_prompt = (None, None)
+
+
+def get_categorize_prompt():
+    """
+    The categorisation prompt listing the current space types. It is built
+    on first use and again only when the taxonomy file changes.
+    """
+    global _categorize_prompt
+    version = space_taxonomy.version
+    built_version, prompt = _categorize_prompt
+    if prompt is None or built_version != version:
+        prompt = CATEGORIZE_PROMPT_TEMPLATE.format(
+            internal_types=get_space_types(INTERNAL_SPACE_KEYS),
+            external_types=get_space_types(EXTERNAL_SPACE_KEYS),
+        )
+        _categorize_prompt = (version, prompt)
+    return prompt
+
+
+def __getattr__(name):
+    # These used to be built from data.json at import time
+    if name == "categorize_prompt":
+        return get_categorize_prompt()
+    if name == "spaces":
+        return space_taxonomy.spaces
+    if name == "internal_types":
+        return get_space_types(INTERNAL_SPACE_KEYS)
+    if name == "external_types":
+        return get_space_types(EXTERNAL_SPACE_KEYS)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 internal_prompt = """
 You are a seasoned realtor with 15 years of experience in the UK. Provide a detailed analysis of the internal image(s), considering Modernization, Fixtures and Fittings, Repair Needs.
@@ -1,33 +1,47 @@
+import asyncio
 import base64
 import json
 from collections import Counter
 
-import numpy as np
 from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.files.base import ContentFile
-from sklearn.metrics.pairwise import cosine_similarity
+from django.db import transaction
 
 from analysis.models import (
     GroupedImages,
     MergedPropertyImage,
-    MergedSampleImage,
     Property,
     PropertyImage,
-    SampleImage,
 )
 from property_analysis.config.logging_config import configure_logger
-from utils.image_processing import compute_embedding, merge_images
-from utils.openai_analysis import (
-    analyze_single_image,
-    encode_image,
-    update_prompt_json_file,
+from utils.embeddings import compute_image_embedding
+from utils.grid import (
+    chunk_for_grid,
+    grid_description,
+    new_grid_stats,
+    record_grid_call,
+    summarize_grid_stats,
 )
-from utils.prompts import categorize_prompt, get_prompts, spaces
+from utils.image_processing import merge_images
+from utils.metering import llm_stage
+from utils.openai_analysis import analyze_single_image_async, encode_image
+from utils.prompt_registry import build_labelling_prompt
+from utils.prompts import get_categorize_prompt, get_prompts
+from utils.sample_cache import sample_references
+from utils.taxonomy import TaxonomyLearner, space_taxonomy
 
 logger = configure_logger(__name__)
 
 
-async def process_property(property_url, image_ids, update_progress, phone_number):
+async def process_property(
+    property_url,
+    image_ids,
+    update_progress,
+    phone_number,
+    working_set=None,
+    publish_event=None,
+):
     total_steps = 5  # Total number of main steps in the process
     step = 0  # Current step
 
@@ -63,12 +77,26 @@ async def process_property(property_url, image_ids, update_progress, phone_numbe
         progress = (step / total_steps + sub_progress / total_steps) * 100
         await update_progress(stage, message, progress)
 
+    async def emit_event(event_type, payload):
+        # Streaming partial results is best effort, it never fails the analysis
+        if publish_event is None:
+            return
+        try:
+            await publish_event(event_type, payload)
+        except Exception as e:
+            logger.error(f"Error publishing {event_type} event: {str(e)}")
+
     try:
         # Step 1: Initial categorization
         step = 1
         await update_step_progress("categorization", "Categorizing images", 0)
         await categorize_images(
-            property_instance, image_ids, results, update_step_progress
+            property_instance,
+            image_ids,
+            results,
+            update_step_progress,
+            working_set,
+            emit_event,
         )
         print("Done categorizing...")
 
@@ -81,14 +109,16 @@ async def process_property(property_url, image_ids, update_progress, phone_numbe
         # Step 3: Merging images
         step = 3
         await update_step_progress("merging", "Merging grouped images", 0)
-        await merge_grouped_images(property_instance, results, update_step_progress)
+        await merge_grouped_images(
+            property_instance, results, update_step_progress, working_set
+        )
         print("Done merging...")
 
         # Step 4: Detailed analysis
         step = 4
         await update_step_progress("analysis", "Analyzing merged images", 0)
         all_condition_labels, all_condition_scores = await analyze_merged_images(
-            property_instance, results, update_step_progress
+            property_instance, results, update_step_progress, working_set, emit_event
         )
         print("Done analyzing...")
 
@@ -103,6 +133,7 @@ async def process_property(property_url, image_ids, update_progress, phone_numbe
             all_condition_labels, all_condition_scores, property_instance.bedrooms
         )
         results["stages"]["overall_condition"] = property_condition
+        await emit_event("overall_condition", {"condition": property_condition})
 
         logger.info(f"==================== Final Result completed ====================")
 
@@ -132,44 +163,140 @@ async def process_property(property_url, image_ids, update_progress, phone_numbe
 
 
 async def categorize_images(
-    property_instance, image_ids, results, update_step_progress
+    property_instance,
+    image_ids,
+    results,
+    update_step_progress,
+    working_set=None,
+    emit_event=None,
 ):
-    total_batches = (len(image_ids) + 3) // 4  # Round up division
-    for batch_num, i in enumerate(range(0, len(image_ids), 4), 1):
-        batch = image_ids[i : i + 4]
-        if not batch:
-            continue
-
-        images = await sync_to_async(list)(PropertyImage.objects.filter(id__in=batch))
-        merged_image = await merge_images(images)
-        base64_encoded = base64.b64encode(merged_image).decode("utf-8")
-        # base64_encoded = f"data:image/png;base64,{base64_encoded}"
-        base64_image = f"data:image/jpeg;base64,{base64_encoded}"
+    grid_layout = settings.CATEGORIZATION_GRID
+    side, batches = chunk_for_grid(image_ids, grid_layout)
+    total_batches = len(batches)
+    grid_stats = new_grid_stats(grid_layout)
+    semaphore = asyncio.Semaphore(settings.CATEGORIZATION_CONCURRENCY)
+    completed_batches = 0
+    failed_batches = 0
+    # Lists the space types known when this property's categorisation starts
+    categorize_prompt = get_categorize_prompt()
+
+    async def request_batch(batch):
+        nonlocal completed_batches
+        async with semaphore:
+            images = await sync_to_async(list)(
+                PropertyImage.objects.filter(id__in=batch)
+            )
+            # Quadrant numbers must follow the batch order, not the queryset order
+            images.sort(key=lambda img: batch.index(img.id))
+            merged_image = await merge_images(
+                images, working_set=working_set, grid_size=side
+            )
+            base64_encoded = base64.b64encode(merged_image).decode("utf-8")
+            # base64_encoded = f"data:image/png;base64,{base64_encoded}"
+            base64_image = f"data:image/jpeg;base64,{base64_encoded}"
 
-        structured_output = analyze_single_image(categorize_prompt, base64_image)
-        category_result = structured_output["response_content"]
+            structured_output = await analyze_single_image_async(
+                categorize_prompt + grid_description(side, len(images)), base64_image
+            )
 
-        if category_result:
-            result = json.loads(category_result)
-            logger.info(f"This is the result: {result}")
+        completed_batches += 1
+        await update_step_progress(
+            "categorization",
+            f"Categorized batch {completed_batches}/{total_batches}",
+            completed_batches / total_batches,
+        )
 
-            await update_prompt_json_file(spaces, result)
-            logger.info("Finished updating json file")
+        # A failed batch leaves its images uncategorised instead of aborting the others
+        if not structured_output or "error" in structured_output:
+            logger.error(
+                f"Categorization failed for batch {batch}: "
+                f"{(structured_output or {}).get('error', 'no response')}"
+            )
+            return None
+        try:
+            category_result = structured_output["response_content"]
+            category_result = json.loads(category_result) if category_result else None
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid categorization response for batch {batch}: {e}")
+            category_result = None
+        record_grid_call(
+            grid_stats,
+            side,
+            len(batch),
+            min(len((category_result or {}).get("images", [])), len(batch)),
+            structured_output,
+        )
 
-            for index, image_id in enumerate(batch):
-                if index < len(result.get("images", [])):
-                    img_result = result["images"][index]
-                    await update_property_image_category(image_id, img_result)
-                    results["stages"]["initial_categorization"].append(img_result)
-                else:
-                    logger.info(f"No result for image at index {index}")
+        # Stream each image's category as soon as its batch is answered
+        if category_result and emit_event is not None:
+            for image_id, img_result in zip(batch, category_result.get("images", [])):
+                await emit_event(
+                    "image_categorized",
+                    {
+                        "image_id": image_id,
+                        "category": img_result.get("category", ""),
+                        "details": img_result.get("details", {}),
+                    },
+                )
+        return category_result
 
-        await update_step_progress(
-            "categorization",
-            f"Categorized batch {batch_num}/{total_batches}",
-            (batch_num) / total_batches,
+    async def categorize_batch(batch):
+        # A failed batch leaves its images uncategorised instead of cancelling
+        # the others, whatever step it failed in
+        nonlocal failed_batches
+        try:
+            category_result = await request_batch(batch)
+        except Exception as e:
+            logger.error(f"Categorization failed for batch {batch}: {str(e)}")
+            category_result = None
+        if category_result is None:
+            failed_batches += 1
+        return category_result
+
+    # Batches run concurrently, their results are applied in the original order
+    with llm_stage("categorization"):
+        batch_results = await asyncio.gather(
+            *(categorize_batch(batch) for batch in batches)
         )
 
+    images_by_id = await PropertyImage.objects.ain_bulk(image_ids)
+    categorized_images = []
+    # New space types are collected for the whole property and saved once
+    taxonomy_learner = TaxonomyLearner()
+    for batch, result in zip(batches, batch_results):
+        if not result:
+            continue
+        logger.info(f"This is the result: {result}")
+
+        taxonomy_learner.learn(result)
+
+        for index, image_id in enumerate(batch):
+            if index < len(result.get("images", [])):
+                img_result = result["images"][index]
+                property_image = images_by_id.get(image_id)
+                if property_image is not None:
+                    set_property_image_category(
+                        property_image, img_result, taxonomy_learner
+                    )
+                    categorized_images.append(property_image)
+                results["stages"]["initial_categorization"].append(img_result)
+            else:
+                logger.info(f"No result for image at index {index}")
+
+    # One UPDATE for the whole property instead of a save per image
+    await PropertyImage.objects.abulk_update(
+        categorized_images, ["main_category", "sub_category", "room_type"]
+    )
+    await sync_to_async(taxonomy_learner.persist)()
+    results["Image_Analysis"]["categorization"] = summarize_grid_stats(grid_stats)
+    results["Image_Analysis"]["categorization"]["failed_batches"] = failed_batches
+
+
+def is_labelled(property_image):
+    return bool(property_image.condition_label) and (
+        property_image.condition_score is not None
+    )
+
 
 def standardize_condition_label(label: str) -> str:
     """
@@ -186,15 +313,10 @@ def standardize_condition_label(label: str) -> str:
     return mapping.get(label, "Average")
 
 
-async def update_property_image_category(image_id, category_info):
-    property_image = await PropertyImage.objects.aget(id=image_id)
+def set_property_image_category(property_image, category_info, taxonomy=space_taxonomy):
     property_image.main_category = category_info.get("category", "")
     details = category_info.get("details", {})
 
-    # Load the data.json content
-    with open("utils/data.json", "r") as f:
-        data_json = json.load(f)
-
     # Determine sub_category and space_type
     if property_image.main_category == "internal":
         sub_category = details.get("room_type", "")
@@ -207,21 +329,14 @@ async def update_property_image_category(image_id, category_info):
         space_type = sub_category
 
     # Find the matching subcategory in data.json
-    mapped_sub_category = "others"
-    for key, values in data_json.items():
-        if sub_category.lower() in [v.lower() for v in values]:
-            mapped_sub_category = key
-            break
-
-    property_image.sub_category = mapped_sub_category
+    property_image.sub_category = taxonomy.space_key(sub_category)
     property_image.room_type = (
         space_type  # change room_type to space_type in the database
     )
-    await property_image.asave()
 
     # Logging for debugging
     logger.info(
-        f"Image ID {image_id} categorized as {property_image.main_category} - {property_image.sub_category}"
+        f"Image ID {property_image.id} categorized as {property_image.main_category} - {property_image.sub_category}"
     )
 
 
@@ -229,42 +344,22 @@ async def group_images(property_instance, results, update_step_progress):
     try:
         logger.info(f"Starting grouping images for property: {property_instance.url}")
         images = await sync_to_async(list)(
-            PropertyImage.objects.filter(property=property_instance)
+            PropertyImage.objects.filter(property=property_instance).order_by("id")
         )
         logger.info(f"Total images found: {len(images)}")
 
+        grouped = {}
         for image in images:
-            try:
-                logger.info(
-                    f"Processing image: {image.id} - Main category: {image.main_category}, Sub category: {image.sub_category}"
-                )
-                group, created = await GroupedImages.objects.aget_or_create(
-                    property=property_instance,
-                    main_category=image.main_category,
-                    sub_category=image.sub_category,
-                )
-                await group.images.aadd(image)
-
-                if created:
-                    logger.info(
-                        f"Created new group: {image.main_category} - {image.sub_category}"
-                    )
-                    results["stages"]["grouped_images"].setdefault(
-                        image.main_category, {}
-                    )[image.sub_category] = []
-
-                results["stages"]["grouped_images"][image.main_category][
-                    image.sub_category
-                ].append(image.id)
-                logger.info(
-                    f"Added image {image.id} to group {image.main_category} - {image.sub_category}"
-                )
-
-            except Exception as e:
-                logger.error(f"Error processing image {image.id}: {str(e)}")
-                import traceback
+            grouped.setdefault((image.main_category, image.sub_category), []).append(
+                image
+            )
+            results["stages"]["grouped_images"].setdefault(image.main_category, {})
+            results["stages"]["grouped_images"][image.main_category].setdefault(
+                image.sub_category, []
+            ).append(image.id)
 
-                traceback.print_exc()
+        await sync_to_async(save_groups)(property_instance, grouped)
+        logger.info(f"Created {len(grouped)} groups from {len(images)} images")
 
         logger.info("Finished grouping all images")
         await update_step_progress("grouping", "Finished grouping images", 1)
@@ -280,7 +375,33 @@ async def group_images(property_instance, results, update_step_progress):
     logger.info(json.dumps(results["stages"]["grouped_images"], indent=2))
 
 
-async def merge_grouped_images(property_instance, results, update_step_progress):
+def save_groups(property_instance, grouped):
+    """Replace the property's groups with `grouped` in one transaction and a few queries."""
+    GroupedImagesThrough = GroupedImages.images.through
+    with transaction.atomic():
+        GroupedImages.objects.filter(property=property_instance).delete()
+        groups = GroupedImages.objects.bulk_create(
+            [
+                GroupedImages(
+                    property=property_instance,
+                    main_category=main_category,
+                    sub_category=sub_category,
+                )
+                for main_category, sub_category in grouped
+            ]
+        )
+        GroupedImagesThrough.objects.bulk_create(
+            [
+                GroupedImagesThrough(groupedimages_id=group.id, propertyimage_id=image.id)
+                for group, images in zip(groups, grouped.values())
+                for image in images
+            ]
+        )
+
+
+async def merge_grouped_images(
+    property_instance, results, update_step_progress, working_set=None
+):
     try:
         logger.info(
             f"Starting merging grouped images for property: {property_instance.url}"
@@ -299,21 +420,32 @@ async def merge_grouped_images(property_instance, results, update_step_progress)
                 images = await sync_to_async(list)(group.images.all())
                 logger.info(f"Images in group: {len(images)}")
 
-                # Split into subgroups of 4 if there are more than 4 images
-                subgroups = [images[i : i + 4] for i in range(0, len(images), 4)]
+                # Labelled images first, so images kept from a previous analysis
+                # fill whole subgroups whose labels can be reused
+                images.sort(key=lambda img: (not is_labelled(img), img.id))
+
+                # Split into subgroups that each fill at most one grid
+                side, subgroups = chunk_for_grid(images, settings.LABELLING_GRID)
+                # Quadrants follow id order, as analyze_merged_image expects
+                subgroups = [
+                    sorted(subgroup, key=lambda img: img.id) for subgroup in subgroups
+                ]
 
                 for subgroup_idx, subgroup in enumerate(subgroups):
                     try:
                         logger.info(
                             f"Merging subgroup {subgroup_idx + 1} of {len(subgroups)}"
                         )
-                        merged_image = await merge_images(subgroup)
+                        merged_image = await merge_images(
+                            subgroup, working_set=working_set, grid_size=side
+                        )
 
                         merged_property_image = (
                             await MergedPropertyImage.objects.acreate(
                                 property=property_instance,
                                 main_category=group.main_category,
                                 sub_category=group.sub_category,
+                                grid_size=side,
                             )
                         )
                         filename = f"merged_image_{merged_property_image.id}.jpg"
@@ -322,6 +454,10 @@ async def merge_grouped_images(property_instance, results, update_step_progress)
                         )
                         # Associate images used to create the merged image
                         await merged_property_image.images.aset(subgroup)
+                        if working_set is not None:
+                            working_set.add_merged_image(
+                                merged_property_image.id, merged_image
+                            )
 
                         results["stages"]["merged_images"].setdefault(
                             f"{group.main_category}_{group.sub_category}", []
@@ -361,192 +497,263 @@ async def merge_grouped_images(property_instance, results, update_step_progress)
     logger.info(json.dumps(results["stages"]["merged_images"], indent=2))
 
 
-async def analyze_merged_images(property_instance, results, update_step_progress):
+async def analyze_merged_images(
+    property_instance,
+    results,
+    update_step_progress,
+    working_set=None,
+    emit_event=None,
+):
     # Fetch the prompt
     labelling_prompt = await sync_to_async(get_prompts)()
+    await sync_to_async(sample_references.check_version)()
 
     merged_images = await sync_to_async(list)(
         MergedPropertyImage.objects.filter(property=property_instance)
     )
     total_analyses = len(merged_images)
+    semaphore = asyncio.Semaphore(settings.LABELLING_CONCURRENCY)
+    completed_analyses = 0
+    grid_stats = new_grid_stats(settings.LABELLING_GRID)
 
-    all_condition_scores = []
-    all_condition_labels = []
-
-    for idx, merged_image in enumerate(merged_images):
-        # Retrieve sample images and their embeddings for the same category and subcategory
-        sample_merged_images = await sync_to_async(list)(
-            MergedSampleImage.objects.filter(
-                category=merged_image.main_category,
-                subcategory=merged_image.sub_category,
+    async def analyze_group(merged_image):
+        nonlocal completed_analyses
+        async with semaphore:
+            try:
+                group_result = await analyze_merged_image(
+                    merged_image, labelling_prompt, working_set, grid_stats
+                )
+            except Exception as e:
+                # One failing group must not cancel the others
+                logger.error(f"Error analyzing merged image {merged_image.id}: {str(e)}")
+                group_result = None
+
+        if group_result is not None and emit_event is not None:
+            key, processed_analyses = group_result
+            await emit_event(
+                "group_labelled",
+                {
+                    "group": key,
+                    "merged_image_id": merged_image.id,
+                    "images": processed_analyses,
+                },
             )
+
+        completed_analyses += 1
+        await update_step_progress(
+            "analysis",
+            f"Analyzed group {completed_analyses}/{total_analyses}",
+            completed_analyses / total_analyses,
         )
+        return group_result
 
-        # Encode sample images
-        sample_images_dict = {}
-        conditions = []
-        # For each sample merged image (should be one per condition)
-        for sample_merged_image in sample_merged_images:
-            condition_label = sample_merged_image.condition
-            encoded_image = encode_image(sample_merged_image.image)
-            sample_images_dict[condition_label] = (
-                f"data:image/jpeg;base64,{encoded_image}"
-            )
-            conditions.append(condition_label)
+    with llm_stage("labelling"):
+        group_results = await asyncio.gather(
+            *(analyze_group(merged_image) for merged_image in merged_images)
+        )
 
-        if not sample_images_dict:
+    results["Image_Analysis"]["labelling"] = summarize_grid_stats(grid_stats)
+    results["Image_Analysis"]["labelling"]["failed_groups"] = sum(
+        1 for group_result in group_results if group_result is None
+    )
+
+    # Aggregate in merged image order so results don't depend on completion order
+    all_condition_scores = []
+    all_condition_labels = []
+    for group_result in group_results:
+        if group_result is None:
             continue
+        key, processed_analyses = group_result
+        results["stages"]["detailed_analysis"].setdefault(key, []).extend(
+            processed_analyses
+        )
+        for analysis in processed_analyses:
+            all_condition_labels.append(analysis["condition_label"])
+            all_condition_scores.append(analysis["condition_score"])
+
+    return all_condition_labels, all_condition_scores
 
-        # Encode the merged image
-        encoded_merged_image = encode_image(merged_image.image)
-        base64_merged_image = f"data:image/jpeg;base64,{encoded_merged_image}"
 
-        full_prompt = (
-            f"{labelling_prompt}\n\nSample images are provided for the following conditions: {', '.join(conditions)}. "
-            f"The target images (2x2 grid) follow these sample images."
+async def request_labelling(full_prompt, base64_merged_image, sample_images_dict):
+    # Runs while holding the labelling semaphore, so backing off here also
+    # throttles the other groups waiting for a slot
+    for attempt in range(settings.LABELLING_RATE_LIMIT_RETRIES + 1):
+        structured_output = await analyze_single_image_async(
+            full_prompt, base64_merged_image, sample_images_dict
         )
+        if not structured_output or not structured_output.get("rate_limited"):
+            break
+        if attempt < settings.LABELLING_RATE_LIMIT_RETRIES:
+            delay = 2**attempt
+            logger.info(f"Rate limited while labelling, retrying in {delay}s")
+            await asyncio.sleep(delay)
+    return structured_output
 
-        try:
-            structured_output = analyze_single_image(
-                full_prompt, base64_merged_image, sample_images_dict
-            )
-            if "error" in structured_output:
-                logger.info(
-                    f"Error in analyze_single_image: {structured_output['error']}"
-                )
-                continue
-            result = structured_output["response_content"]
-            # print("This is the result I want to check: ", result)
-        except Exception as e:
-            logger.error(f"Exception in analyze_single_image: {str(e)}")
-            continue
 
-        if result:
-            try:
-                parsed_result = json.loads(result)
-                image_analyses = parsed_result.get("images", [])
+def read_image_file(image_field):
+    # open() works on every storage backend, .path only on the local filesystem
+    with image_field.open("rb") as image_file:
+        return image_file.read()
 
-                processed_analyses = []
 
-                # Retrieve individual target images associated with the merged image
-                images_in_merged_image = await sync_to_async(list)(
-                    merged_image.images.all().order_by("id")
-                )
+async def analyze_merged_image(
+    merged_image, labelling_prompt, working_set=None, grid_stats=None
+):
+    """
+    Label the images of one merged property image and score them against the
+    sample images. Returns (results key, processed analyses), or None if the
+    group could not be analysed.
+    """
+    key = f"{merged_image.main_category}_{merged_image.sub_category}"
 
-                # Ensure embeddings are available for target images
-                for img in images_in_merged_image:
-                    if img.embedding is None:
-                        # Compute and store embedding if not available
-                        image_file = img.image.path
-                        embedding = compute_embedding(image_file)
-                        img.embedding = embedding.tolist()
-                        await img.asave()
-                    else:
-                        embedding = np.array(img.embedding)
-
-                    # Store the embedding in a variable for later use
-                    img.embedding_array = embedding
-
-                # Map image_tag_number to PropertyImage
-                # Assuming images are ordered corresponding to quadrants 1-4
-                image_quadrant_mapping = {
-                    i + 1: img for i, img in enumerate(images_in_merged_image)
-                }
-
-                # -------------------------
-                # Compute Similarity Scores
-                # -------------------------
-                for analysis in image_analyses:
-                    image_number = int(analysis.get("image_tag_number"))
-                    img = image_quadrant_mapping.get(image_number)
-                    if not img:
-                        logger.warning(
-                            f"No image found for image_number {image_number}"
-                        )
-                        continue
-
-                    condition_label_raw = analysis.get("condition", "Average")
-                    condition_label = standardize_condition_label(condition_label_raw)
-                    condition_score = int(analysis.get("condition_score", 50))
-                    all_condition_scores.append(condition_score)
-                    all_condition_labels.append(condition_label)
-
-                    # Compute similarity scores for this target image
-                    similarities_per_condition = {}
-
-                    for sample_merged_image in sample_merged_images:
-                        condition_label_sample = sample_merged_image.condition
-
-                        # Retrieve individual sample images from the quadrant mapping
-                        sample_quadrant_mapping = (
-                            sample_merged_image.quadrant_mapping
-                        )  # Dict mapping str quadrant number to SampleImage IDs
-                        sample_images = []
-                        for (
-                            quadrant_num_str,
-                            sample_img_id,
-                        ) in sample_quadrant_mapping.items():
-                            sample_img = await sync_to_async(SampleImage.objects.get)(
-                                id=sample_img_id
-                            )
-                            if sample_img.embedding is not None:
-                                sample_embedding = np.array(sample_img.embedding)
-                            else:
-                                # Compute and store embedding if not available
-                                image_file = sample_img.image.path
-                                sample_embedding = compute_embedding(image_file)
-                                sample_img.embedding = sample_embedding.tolist()
-                                await sample_img.asave()
-
-                            # Compute similarity
-                            similarity = cosine_similarity(
-                                [img.embedding_array], [sample_embedding]
-                            )
-                            similarities_per_condition.setdefault(
-                                condition_label_sample, []
-                            ).append(similarity[0][0])
-
-                    # Average similarity scores for each condition
-                    avg_similarities = {
-                        condition: sum(scores) / len(scores) if scores else 0
-                        for condition, scores in similarities_per_condition.items()
-                    }
-
-                    processed_analysis = {
-                        "image_number": image_number,
-                        "condition_label": condition_label,
-                        "condition_score": condition_score,
-                        "reasoning": analysis.get("reasoning", "No reasoning provided"),
-                        "image_url": img.image.url if img.image else None,
-                        "image_id": img.id,
-                        "similarities": avg_similarities,
-                    }
-                    processed_analyses.append(processed_analysis)
-
-                    # Update individual PropertyImage instances
-                    img.condition_label = condition_label
-                    img.condition_score = condition_score
-                    img.reasoning = analysis.get("reasoning", "No reasoning provided")
-                    img.similarity_scores = avg_similarities
-                    await img.asave()
-
-                # Store the processed analyses in results
-                key = f"{merged_image.main_category}_{merged_image.sub_category}"
-                results["stages"]["detailed_analysis"].setdefault(key, []).extend(
-                    processed_analyses
-                )
+    # Retrieve individual target images associated with the merged image
+    images_in_merged_image = await sync_to_async(list)(
+        merged_image.images.all().order_by("id")
+    )
 
-            except json.JSONDecodeError:
-                logger.error(
-                    f"Error decoding JSON for {merged_image.main_category}_{merged_image.sub_category}: {result}"
-                )
+    # Every image was labelled by a previous analysis, reuse its results
+    if images_in_merged_image and all(map(is_labelled, images_in_merged_image)):
+        logger.info(f"Reusing stored labels for merged image {merged_image.id}")
+        return key, [
+            {
+                "image_number": idx + 1,
+                "condition_label": img.condition_label,
+                "condition_score": img.condition_score,
+                "reasoning": img.reasoning,
+                "image_url": img.image.url if img.image else None,
+                "image_id": img.id,
+                "similarities": img.similarity_scores,
+            }
+            for idx, img in enumerate(images_in_merged_image)
+        ]
+
+    # Sample images and their embeddings for the same category and subcategory
+    reference = await sync_to_async(sample_references.get)(
+        merged_image.main_category, merged_image.sub_category
+    )
+    if reference is None:
+        return None
+    sample_images_dict = reference.sample_images_dict
+    conditions = reference.conditions
+
+    # Encode the merged image, from memory when this analysis just built it
+    merged_image_content = (
+        working_set.get_merged_image(merged_image.id)
+        if working_set is not None
+        else None
+    )
+    if merged_image_content is not None:
+        encoded_merged_image = base64.b64encode(merged_image_content).decode("utf-8")
+    else:
+        encoded_merged_image = encode_image(merged_image.image)
+    base64_merged_image = f"data:image/jpeg;base64,{encoded_merged_image}"
 
-        await update_step_progress(
-            "analysis",
-            f"Analyzed group {idx+1}/{total_analyses}",
-            (idx + 1) / total_analyses,
+    full_prompt = build_labelling_prompt(
+        labelling_prompt, tuple(conditions), merged_image.grid_size
+    )
+
+    def account(structured_output, covered_images=0):
+        # Tokens and coverage per grid layout, to compare layouts
+        if grid_stats is not None:
+            record_grid_call(
+                grid_stats,
+                merged_image.grid_size,
+                len(images_in_merged_image),
+                covered_images,
+                structured_output,
+            )
+
+    try:
+        structured_output = await request_labelling(
+            full_prompt, base64_merged_image, sample_images_dict
         )
-    return all_condition_labels, all_condition_scores
+        if "error" in structured_output:
+            logger.info(f"Error in analyze_single_image: {structured_output['error']}")
+            account(structured_output)
+            return None
+        result = structured_output["response_content"]
+        # print("This is the result I want to check: ", result)
+    except Exception as e:
+        logger.error(f"Exception in analyze_single_image: {str(e)}")
+        return None
+
+    if not result:
+        account(structured_output)
+        return None
+
+    try:
+        parsed_result = json.loads(result)
+    except json.JSONDecodeError:
+        logger.error(f"Error decoding JSON for {key}: {result}")
+        account(structured_output)
+        return None
+
+    image_analyses = parsed_result.get("images", [])
+    processed_analyses = []
+
+    # Ensure embeddings are available for target images
+    for img in images_in_merged_image:
+        embedding = img.get_embedding()
+        if embedding is None:
+            # Compute and store embedding if not available, through the shared
+            # batcher so CLIP doesn't block the other groups on the event loop
+            image_content = await sync_to_async(read_image_file)(img.image)
+            embedding = await compute_image_embedding(image_content)
+            img.set_embedding(embedding)
+            await img.asave(update_fields=["embedding"])
+
+        # Store the embedding in a variable for later use
+        img.embedding_array = embedding
+
+    # Map image_tag_number to PropertyImage
+    # Assuming images are ordered corresponding to grid cells 1..n
+    image_quadrant_mapping = {i + 1: img for i, img in enumerate(images_in_merged_image)}
+
+    # -------------------------
+    # Compute Similarity Scores
+    # -------------------------
+    # Every target against every sample in one matrix multiply
+    group_similarities = reference.similarities(
+        [img.embedding_array for img in images_in_merged_image]
+    )
+    for img, similarities in zip(images_in_merged_image, group_similarities):
+        img.similarities = similarities
+
+    for analysis in image_analyses:
+        image_number = int(analysis.get("image_tag_number"))
+        img = image_quadrant_mapping.get(image_number)
+        if not img:
+            logger.warning(f"No image found for image_number {image_number}")
+            continue
+
+        condition_label_raw = analysis.get("condition", "Average")
+        condition_label = standardize_condition_label(condition_label_raw)
+        condition_score = int(analysis.get("condition_score", 50))
+        avg_similarities = img.similarities
+
+        processed_analysis = {
+            "image_number": image_number,
+            "condition_label": condition_label,
+            "condition_score": condition_score,
+            "reasoning": analysis.get("reasoning", "No reasoning provided"),
+            "image_url": img.image.url if img.image else None,
+            "image_id": img.id,
+            "similarities": avg_similarities,
+        }
+        processed_analyses.append(processed_analysis)
+
+        # Update individual PropertyImage instances
+        img.condition_label = condition_label
+        img.condition_score = condition_score
+        img.reasoning = analysis.get("reasoning", "No reasoning provided")
+        img.similarity_scores = avg_similarities
+        await img.asave()
+
+    account(
+        structured_output,
+        len({analysis["image_id"] for analysis in processed_analyses}),
+    )
+    return key, processed_analyses
 
 
 def get_confidence_level(total_assessments, bedrooms):
@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+
+from analysis.models import CacheVersion, MergedSampleImage, SampleImage
+from property_analysis.config.logging_config import configure_logger
+from utils.embeddings import compute_embedding
+from utils.openai_analysis import encode_image
+from utils.similarity import condition_similarities, l2_normalize
+
+logger = configure_logger(__name__)
+
+# Bumped by load_sample_images whenever the reference set is rebuilt
+SAMPLE_IMAGES_CACHE = "sample_images"
+
+
+class SampleReference:
+    """
+    Everything analyze_merged_image needs about the samples of one
+    (category, subcategory): the merged sample images as data URLs keyed by
+    condition, and every individual sample embedding stacked into a matrix.
+    """
+
+    def __init__(self, sample_images_dict, embeddings, embedding_conditions):
+        self.sample_images_dict = sample_images_dict
+        self.conditions = list(sample_images_dict)
+        self.embeddings = embeddings
+        self.normalized_embeddings = l2_normalize(embeddings)
+        self.embedding_conditions = embedding_conditions
+
+    def similarities(self, target_embeddings):
+        return condition_similarities(
+            target_embeddings, self.normalized_embeddings, self.embedding_conditions
+        )
+
+
+class SampleReferenceCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._references = {}
+
+    def check_version(self):
+        """Drop every cached reference if the samples were reloaded since they were built."""
+        version = CacheVersion.get_version(SAMPLE_IMAGES_CACHE)
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.info(
+                        f"Sample images changed (v{self._version} -> v{version}), clearing cache"
+                    )
+                self._references = {}
+                self._version = version
+
+    def get(self, category, subcategory):
+        key = (category, subcategory)
+        with self._lock:
+            if key in self._references:
+                return self._references[key]
+
+        reference = self._build(category, subcategory)
+        with self._lock:
+            self._references[key] = reference
+        return reference
+
+    def _build(self, category, subcategory):
+        sample_merged_images = list(
+            MergedSampleImage.objects.filter(category=category, subcategory=subcategory)
+        )
+        if not sample_merged_images:
+            return None
+
+        sample_ids = [
+            sample_img_id
+            for sample_merged_image in sample_merged_images
+            for sample_img_id in (sample_merged_image.quadrant_mapping or {}).values()
+        ]
+        sample_images = SampleImage.objects.in_bulk(sample_ids)
+
+        sample_images_dict = {}
+        embeddings = []
+        embedding_conditions = []
+        # For each sample merged image (should be one per condition)
+        for sample_merged_image in sample_merged_images:
+            condition = sample_merged_image.condition
+            encoded_image = encode_image(sample_merged_image.image)
+            sample_images_dict[condition] = f"data:image/jpeg;base64,{encoded_image}"
+
+            quadrant_mapping = sample_merged_image.quadrant_mapping or {}
+            for quadrant_num_str in sorted(quadrant_mapping, key=int):
+                sample_img = sample_images.get(quadrant_mapping[quadrant_num_str])
+                if sample_img is None:
+                    continue
+                sample_embedding = sample_img.get_embedding()
+                if sample_embedding is None:
+                    # Compute and store embedding if not available
+                    sample_embedding = compute_embedding(sample_img.image.path)
+                    sample_img.set_embedding(sample_embedding)
+                    sample_img.save()
+                embeddings.append(sample_embedding)
+                embedding_conditions.append(condition)
+
+        logger.info(
+            f"Cached {len(embeddings)} sample embeddings for {category}/{subcategory}"
+        )
+        embedding_matrix = (
+            np.stack(embeddings).astype(np.float32)
+            if embeddings
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        return SampleReference(sample_images_dict, embedding_matrix, embedding_conditions)
+
+
+sample_references = SampleReferenceCache()
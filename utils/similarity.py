@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def l2_normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def condition_membership(sample_conditions):
+    """
+    Group-by indices for the sample rows: returns the conditions in first-seen
+    order and a (samples, conditions) one-hot matrix mapping rows to them.
+    """
+    conditions = list(dict.fromkeys(sample_conditions))
+    condition_index = np.array(
+        [conditions.index(condition) for condition in sample_conditions], dtype=np.intp
+    )
+    membership = np.zeros((len(sample_conditions), len(conditions)), dtype=np.float32)
+    membership[np.arange(len(sample_conditions)), condition_index] = 1.0
+    return conditions, membership
+
+
+def condition_similarities(target_embeddings, normalized_samples, sample_conditions):
+    """
+    Cosine similarity of every target embedding against every sample embedding,
+    averaged per condition. `normalized_samples` must already be L2-normalised.
+    Returns one {condition: average similarity} dict per target embedding.
+    """
+    if len(target_embeddings) == 0:
+        return []
+    if len(sample_conditions) == 0:
+        return [{} for _ in target_embeddings]
+
+    conditions, membership = condition_membership(sample_conditions)
+    similarities = l2_normalize(target_embeddings) @ normalized_samples.T
+    averages = (similarities @ membership) / membership.sum(axis=0)
+
+    return [
+        {condition: float(row[i]) for i, condition in enumerate(conditions)}
+        for row in averages
+    ]
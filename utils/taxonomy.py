@@ -0,0 +1,172 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+from property_analysis.config.logging_config import configure_logger
+
+logger = configure_logger(__name__)
+
+TAXONOMY_PATH = "utils/data.json"
+
+
+class SpaceTaxonomy:
+    """
+    The space taxonomy of utils/data.json ({space key: [space types]}) with a
+    lowercase reverse index from space type to space key. The file is only
+    parsed again when its modification time or size changes.
+    """
+
+    def __init__(self, path=TAXONOMY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_state = None
+        self._spaces = {}
+        self._index = {}
+        self._key_types = {}
+
+    def _refresh(self):
+        stat = os.stat(self.path)
+        file_state = (stat.st_mtime_ns, stat.st_size)
+        if file_state == self._file_state:
+            return
+        with self._lock:
+            if file_state == self._file_state:
+                return
+            with open(self.path, "r") as f:
+                spaces = json.load(f)
+
+            index = {}
+            for key, values in spaces.items():
+                for value in values:
+                    # The first space key listing a type wins, as in data.json order
+                    index.setdefault(value.lower(), key)
+
+            self._spaces = spaces
+            self._index = index
+            self._key_types = {
+                key: {value.lower() for value in values}
+                for key, values in spaces.items()
+            }
+            self._file_state = file_state
+            logger.info(f"Loaded space taxonomy with {len(index)} space types")
+
+    @property
+    def spaces(self):
+        self._refresh()
+        return self._spaces
+
+    @property
+    def version(self):
+        """Changes whenever the taxonomy file does."""
+        self._refresh()
+        return self._file_state
+
+    def space_key(self, space_type, default="others"):
+        self._refresh()
+        return self._index.get((space_type or "").lower(), default)
+
+    def has_type(self, space_type, key=None):
+        """Whether space_type is listed at all, or under `key` when given."""
+        self._refresh()
+        space_type = (space_type or "").lower()
+        if key is None:
+            return space_type in self._index
+        return space_type in self._key_types.get(key, set())
+
+
+space_taxonomy = SpaceTaxonomy()
+
+
+class TaxonomyLearner:
+    """
+    Space types the categorisation returned that the taxonomy doesn't list
+    yet, collected over a whole property. persist() merges them into the
+    taxonomy file once, under an exclusive file lock and with an atomic
+    rename, so concurrent workers never lose each other's additions.
+    """
+
+    def __init__(self, taxonomy=space_taxonomy):
+        self.taxonomy = taxonomy
+        self.learned = {}
+        self._learned_index = {}
+
+    def learn(self, classifications):
+        for classification in classifications.get("images", []):
+            category = classification.get("category")
+            details = classification.get("details") or {}
+
+            if category == "internal":
+                self._add(details.get("room_type"), "living_space", anywhere=True)
+                self._add(details.get("others"), "others")
+            elif category == "external":
+                self._add(
+                    details.get("exterior_type"), "front_garden_space", anywhere=True
+                )
+                self._add(details.get("others"), "others")
+            elif category == "floor plan":
+                self._add(details.get("floor_type"), "others")
+            elif category == "others":
+                self._add(details.get("others"), "others")
+
+    def _add(self, space_type, key, anywhere=False):
+        # New room and exterior types are checked against the whole taxonomy,
+        # everything else only against "others"
+        if not space_type or not isinstance(space_type, str):
+            return
+        lowered = space_type.lower()
+        if anywhere:
+            if lowered in self._learned_index or self.taxonomy.has_type(space_type):
+                return
+        elif lowered in {value.lower() for value in self.learned.get(key, ())} or (
+            self.taxonomy.has_type(space_type, key)
+        ):
+            return
+        self.learned.setdefault(key, set()).add(space_type)
+        self._learned_index.setdefault(lowered, key)
+
+    def space_key(self, space_type, default="others"):
+        """Like SpaceTaxonomy.space_key, including the types learned so far."""
+        key = self.taxonomy.space_key(space_type, default=None)
+        if key is None:
+            key = self._learned_index.get((space_type or "").lower(), default)
+        return key
+
+    def persist(self):
+        if not self.learned:
+            return
+        path = self.taxonomy.path
+        directory = os.path.dirname(os.path.abspath(path))
+        with open(f"{path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Merge into the current file, another worker may have added types
+                with open(path, "r") as f:
+                    spaces = json.load(f)
+                added = 0
+                for key, space_types in self.learned.items():
+                    values = spaces.setdefault(key, [])
+                    existing = {value.lower() for value in values}
+                    for space_type in sorted(space_types):
+                        if space_type.lower() not in existing:
+                            values.append(space_type)
+                            existing.add(space_type.lower())
+                            added += 1
+
+                if added:
+                    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+                    try:
+                        with os.fdopen(fd, "w") as f:
+                            json.dump(spaces, f, indent=4)
+                        os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+                        os.replace(tmp_path, path)
+                    except Exception:
+                        os.unlink(tmp_path)
+                        raise
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        logger.info(f"Added {added} new space types to the taxonomy")
+        self.learned = {}
+        self._learned_index = {}
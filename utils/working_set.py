@@ -0,0 +1,26 @@
+class ImageWorkingSet:
+    """
+    In-memory images of one analysis. Every downloaded photo is decoded once
+    and kept as the letterboxed tile merge_images composites, and merged
+    group images are kept as the JPEG bytes sent for labelling, so later
+    stages don't read and decode them from storage again.
+    """
+
+    def __init__(self):
+        self._tiles = {}
+        self._merged_images = {}
+
+    def add_tile(self, image_id, tile):
+        self._tiles[image_id] = tile
+
+    def get_tile(self, image_id):
+        return self._tiles.get(image_id)
+
+    def add_merged_image(self, merged_image_id, merged_image_content):
+        self._merged_images[merged_image_id] = merged_image_content
+
+    def get_merged_image(self, merged_image_id):
+        return self._merged_images.get(merged_image_id)
+
+    def __len__(self):
+        return len(self._tiles)